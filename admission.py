@@ -0,0 +1,73 @@
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+
+
+class Overloaded(Exception):
+    """The request was shed: its queue is full or it waited too long"""
+
+
+class AdmissionControl:
+    """Bounded queue per key, each drained by its own writer thread.
+
+    Jobs for one key (a competition) run one at a time, in arrival order,
+    so they never race each other. Once 'max_queue' jobs are waiting the
+    next ones are refused at once, and a job still queued after 'timeout'
+    seconds is dropped, which keeps latency bounded during a surge.
+    A writer thread exits after 'idle_timeout' seconds without work.
+    """
+
+    def __init__(self, max_queue=64, timeout=5.0, idle_timeout=30.0):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._queues = {}
+
+    def submit(self, key, job):
+        """Run job() on the writer of 'key' and return its result.
+
+        Raise Overloaded if the queue is full or the job was not started
+        within the timeout.
+        """
+        future = Future()
+        with self._lock:
+            jobs = self._queues.get(key)
+            if jobs is None:
+                jobs = self._queues[key] = queue.Queue(self.max_queue)
+                threading.Thread(
+                    target=self._drain, args=(key, jobs), daemon=True,
+                    name=f"admission-{key}").start()
+            try:
+                jobs.put_nowait((future, job))
+            except queue.Full:
+                raise Overloaded(key) from None
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise Overloaded(key) from None
+        # Already running, it will not take much longer
+        return future.result()
+
+    def pending(self, key):
+        """Number of jobs waiting for 'key'"""
+        jobs = self._queues.get(key)
+        return 0 if jobs is None else jobs.qsize()
+
+    def _drain(self, key, jobs):
+        while True:
+            try:
+                future, job = jobs.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if jobs.empty():
+                        del self._queues[key]
+                        return
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(job())
+            except BaseException as error:
+                future.set_exception(error)
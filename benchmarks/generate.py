@@ -0,0 +1,72 @@
+"""Synthetic clubs and competitions, in the format of data/*.json.
+
+    python -m benchmarks.generate --clubs 5000 --competitions 2000 out/
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from provider import DATE_FORMAT
+
+
+def generate_clubs(count, seed=0):
+    """'count' clubs, with enough points to book a few times"""
+    rng = random.Random(seed)
+    return [
+        {
+            "name": f"Club {n:06}",
+            "email": f"secretary{n}@club{n}.example",
+            "points": str(rng.randint(20, 500)),
+        }
+        for n in range(count)
+    ]
+
+
+def generate_competitions(count, past_ratio=0.5, seed=0):
+    """'count' competitions, 'past_ratio' of them already over"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    past = round(count * past_ratio)
+    competitions = []
+    for n in range(count):
+        days = rng.randint(1, 3650)
+        if n < past:
+            days = -days
+        competitions.append({
+            "name": f"Competition {n:06}",
+            "date": (now + timedelta(days=days)).strftime(DATE_FORMAT),
+            "spotsAvailable": str(rng.randint(10, 10000)),
+        })
+    return competitions
+
+
+def write_data(folder, clubs, competitions):
+    """Write clubs.json and competitions.json, return their paths"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    clubs_path = folder / "clubs.json"
+    competitions_path = folder / "competitions.json"
+    clubs_path.write_text(json.dumps({"clubs": clubs}, indent=4))
+    competitions_path.write_text(
+        json.dumps({"competitions": competitions}, indent=4))
+    return clubs_path, competitions_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder")
+    parser.add_argument("--clubs", type=int, default=1000)
+    parser.add_argument("--competitions", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_data(
+        args.folder,
+        generate_clubs(args.clubs, args.seed),
+        generate_competitions(args.competitions, seed=args.seed),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Replay captured traffic against the app and compare with the capture.
+
+Record real traffic by starting the app with GUDLFT_CAPTURE_LOG set to a
+file, then play it back, here 10 times faster on 16 threads:
+
+    python -m benchmarks.replay capture.jsonl --speedup 10 --workers 16
+    python -m benchmarks.replay capture.jsonl --save-baseline replay.json
+    python -m benchmarks.replay capture.jsonl --baseline replay.json
+
+Each client (a logged in club, or anonymous) replays its requests in
+order, at their captured offsets divided by --speedup, on a copy of the
+data in --data so bookings never touch the real files. The report gives
+per-route latency and errors next to the captured ones; with a baseline,
+regressions are flagged as in benchmarks.run.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import server
+from benchmarks.run import compare, serving, summarize
+from capture import read_capture
+from provider import DATA_FOLDER
+
+DATA = Path(__file__).parent.parent / DATA_FOLDER
+
+
+def route_of(entry):
+    return entry.get("r") or entry["p"].split("?")[0]
+
+
+def send(client, entry):
+    """Send a captured request through a test client"""
+    kwargs = {}
+    if "j" in entry:
+        kwargs["json"] = entry["j"]
+    elif "f" in entry:
+        kwargs["data"] = entry["f"]
+    return client.open(entry["p"], method=entry["m"], **kwargs)
+
+
+def replay(entries, speedup=1.0, workers=8):
+    """Replay 'entries' against server.app, return per-route lists of
+    (seconds, status) and how late requests started, at worst"""
+    by_client = defaultdict(list)
+    for entry in sorted(entries, key=lambda entry: entry["t"]):
+        by_client[entry["c"]].append(entry)
+    results = defaultdict(list)
+    lock = threading.Lock()
+    worst_lag = 0.0
+    start = time.perf_counter()
+
+    def play(client_entries):
+        nonlocal worst_lag
+        with server.app.test_client() as client:
+            for entry in client_entries:
+                delay = start + entry["t"] / speedup - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sent = time.perf_counter()
+                response = send(client, entry)
+                seconds = time.perf_counter() - sent
+                with lock:
+                    worst_lag = max(worst_lag, -delay)
+                    results[route_of(entry)].append(
+                        (seconds, response.status_code))
+
+    with ThreadPoolExecutor(workers) as pool:
+        for future in [pool.submit(play, client_entries)
+                       for client_entries in by_client.values()]:
+            future.result()
+    return results, worst_lag
+
+
+def captured_summary(entries):
+    """Per-route latency summary of the captured requests"""
+    by_route = defaultdict(list)
+    for entry in entries:
+        by_route[route_of(entry)].append((entry["d"], entry["s"]))
+    return summarize_routes(by_route)
+
+
+def summarize_routes(by_route):
+    return {
+        route: summarize(
+            [seconds for seconds, _ in samples],
+            sum(status >= 400 for _, status in samples))
+        for route, samples in by_route.items()
+    }
+
+
+def print_report(captured, replayed, lag):
+    print("Captured > replayed")
+    print(f"{'route':>24} {'requests':>8} {'p50 ms':>17} {'p99 ms':>17} "
+          f"{'errors':>9}")
+    for route, result in sorted(replayed.items()):
+        before = captured.get(route, result)
+        print(f"{route:>24} {result['requests']:>8} "
+              f"{before['p50_ms']:>8}>{result['p50_ms']:<8} "
+              f"{before['p99_ms']:>8}>{result['p99_ms']:<8} "
+              f"{before['errors']:>4}>{result['errors']:<4}")
+    print(f"Requests started up to {lag * 1000:.1f} ms late")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", type=Path, help="capture log to replay")
+    parser.add_argument("--speedup", type=float, default=1.0,
+                        help="play the capture this many times faster")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="clients replayed at the same time")
+    parser.add_argument("--data", type=Path, default=DATA,
+                        help="folder with clubs.json and competitions.json")
+    parser.add_argument("--baseline", type=Path,
+                        help="compare against this saved replay")
+    parser.add_argument("--save-baseline", type=Path,
+                        help="save this replay as a baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown before flagging, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    entries = read_capture(args.capture)
+    clubs = json.loads((args.data / "clubs.json").read_text())["clubs"]
+    competitions = json.loads(
+        (args.data / "competitions.json").read_text())["competitions"]
+    with serving(clubs, competitions):
+        by_route, lag = replay(entries, args.speedup, args.workers)
+    replayed = summarize_routes(by_route)
+    print_report(captured_summary(entries), replayed, lag)
+
+    results = {"replay": replayed}
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=4))
+    if args.baseline:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
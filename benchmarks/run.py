@@ -0,0 +1,179 @@
+"""Throughput and latency of /login, /summary, /book and /clubs.
+
+Every route is driven through app.test_client() against synthetic data
+of several sizes (clubs x competitions):
+
+    python -m benchmarks.run --sizes 100x50 1000x500 5000x2000
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+
+With a baseline, any route whose p50 or p99 latency grew, or whose
+throughput dropped, by more than --threshold is reported as a
+regression and the exit status is 1.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import server
+from benchmarks.generate import (
+    generate_clubs, generate_competitions, write_data
+)
+from journal import BookingJournal
+from provider import DATE_FORMAT, JsonStorage, Registry
+
+BASELINE = Path(__file__).parent / "baseline.json"
+ROUTES = ("login", "summary", "book", "clubs")
+
+
+def percentile(samples, percent):
+    """'percent' percentile of the sorted 'samples'"""
+    index = min(len(samples) - 1, int(len(samples) * percent / 100))
+    return samples[index]
+
+
+def summarize(samples, errors):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput": round(len(samples) / total, 1) if total else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def measure(send, count):
+    """Call send(i) 'count' times, return the latency summary"""
+    samples = []
+    errors = 0
+    for i in range(count):
+        start = time.perf_counter()
+        response = send(i)
+        samples.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+    return summarize(samples, errors)
+
+
+@contextmanager
+def serving(clubs, competitions):
+    """Serve the records from JSON files and a journal in a temp folder,
+    without rate limits since all the requests come from one client"""
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_data(folder, clubs, competitions)
+        journal = BookingJournal(Path(folder) / "bookings.jsonl")
+        registry = Registry(JsonStorage(*paths, journal=journal))
+        server.fragment_cache.clear()
+        with patch("server.registry", registry), patch.dict(
+                server.app.config, LOGIN_RATE_LIMIT=None,
+                BOOKING_RATE_LIMIT=None, CLIENT_RATE_LIMIT=None):
+            yield registry
+        journal.close()
+
+
+def run_size(club_count, competition_count, requests):
+    """Latency summary of every route for one data size"""
+    clubs = generate_clubs(club_count)
+    # The club booking over and over must not run out of points
+    clubs[0]["points"] = str(10 ** 9)
+    competitions = generate_competitions(competition_count)
+    now = datetime.now()
+    upcoming = [
+        competition["name"] for competition in competitions
+        if datetime.strptime(competition["date"], DATE_FORMAT) > now
+    ]
+
+    results = {}
+    with serving(clubs, competitions), server.app.test_client() as client:
+        results["login"] = measure(lambda i: client.post(
+            "/login", data={"email": clubs[i % len(clubs)]["email"]}),
+            requests)
+        client.post("/login", data={"email": clubs[0]["email"]})
+        results["summary"] = measure(
+            lambda i: client.get("/summary"), requests)
+        results["book"] = measure(lambda i: client.post("/book", data={
+            "competition": upcoming[i % len(upcoming)], "spots": "1"}),
+            requests)
+        results["clubs"] = measure(lambda i: client.get("/clubs"), requests)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Regressions of 'results' against 'baseline', as messages"""
+    regressions = []
+    for size, routes in results.items():
+        for route, current in routes.items():
+            previous = baseline.get(size, {}).get(route)
+            if previous is None:
+                continue
+            for metric in ("p50_ms", "p99_ms"):
+                if current[metric] > previous[metric] * (1 + threshold):
+                    regressions.append(
+                        f"{size} {route}: {metric} {previous[metric]} -> "
+                        f"{current[metric]}")
+            if current["throughput"] * (1 + threshold) < (
+                    previous["throughput"]):
+                regressions.append(
+                    f"{size} {route}: throughput {previous['throughput']} "
+                    f"-> {current['throughput']} req/s")
+    return regressions
+
+
+def print_report(results):
+    print(f"{'size':>12} {'route':>8} {'req/s':>9} {'p50 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>6}")
+    for size, routes in results.items():
+        for route, result in routes.items():
+            print(f"{size:>12} {route:>8} {result['throughput']:>9} "
+                  f"{result['p50_ms']:>9} {result['p99_ms']:>9} "
+                  f"{result['errors']:>6}")
+
+
+def parse_size(text):
+    clubs, competitions = text.lower().split("x")
+    return int(clubs), int(competitions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", nargs="+", default=["100x50", "1000x500", "5000x2000"],
+        help="data sizes, as CLUBSxCOMPETITIONS")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per route and size")
+    parser.add_argument("--baseline", type=Path,
+                        help="compare against this saved run")
+    parser.add_argument("--save-baseline", nargs="?", type=Path,
+                        const=BASELINE, help="save this run as a baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown before flagging, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    results = {
+        size: run_size(*parse_size(size), args.requests)
+        for size in args.sizes
+    }
+    print_report(results)
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=4))
+    if args.baseline:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
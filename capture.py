@@ -0,0 +1,56 @@
+import json
+import threading
+import time
+
+
+class TrafficCapture:
+    """Log of the requests served, for benchmarks.replay to play back.
+
+    One compact JSON object per line: seconds since the capture started
+    ("t"), the client ("c", the logged in email or None), method, path
+    with its query string, form fields or JSON body, matched route,
+    status and seconds taken.
+    """
+
+    def __init__(self, path, clock=time.monotonic):
+        self.path = path
+        self._clock = clock
+        self._start = clock()
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def record(self, client, method, path, route, status, duration,
+               form=None, json_body=None):
+        entry = {
+            "t": round(self._clock() - self._start, 4),
+            "c": client,
+            "m": method,
+            "p": path,
+            "r": route,
+            "s": status,
+            "d": round(duration, 6),
+        }
+        if form:
+            entry["f"] = form
+        if json_body is not None:
+            entry["j"] = json_body
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """The entries of a capture log, oldest first; torn lines are
+    skipped"""
+    entries = []
+    with open(path) as fp:
+        for line in fp:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
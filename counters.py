@@ -0,0 +1,213 @@
+import fcntl
+import hashlib
+import os
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+# Header slots, before the competition and club counters
+_GENERATION = 0
+_READY = 1
+_INSTANCE = 2
+_RETIRED = 3
+_PENDING = 4
+_HEADER = 5
+
+
+def _open_segment(name, size=0):
+    """Helper method - create (size > 0) or attach a shared memory segment.
+
+    The segment outlives the process that created it: workers come and
+    go, so it must not be unlinked by whichever one exits first.
+    """
+    create = size > 0
+    try:
+        return shared_memory.SharedMemory(
+            name, create=create, size=size, track=False)
+    except TypeError:  # Python < 3.13 has no 'track'
+        segment = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class SharedCounters:
+    """Spots available and club points in shared memory.
+
+    Every worker attached to the same segment sees the same numbers, and
+    take() checks and decrements them atomically across processes (a
+    file lock guards the segment), without a database round-trip.
+    The segment name is derived from the competition and club names and
+    a data 'version', so workers that loaded the same data share it.
+
+    The workers of one deployment ('prefix') book against one current
+    segment, named in their lock file. A worker that loads new data
+    retires the current segment, so it takes no more bookings, waits
+    up to 'drain_timeout' seconds for the bookings taken from it to be
+    committed, then sets up its own from seed(), which returns the
+    (clubs, competitions) with those bookings in.
+    """
+
+    def __init__(self, competitions, clubs, version=None, prefix="gudlft",
+                 seed=None, drain_timeout=5.0):
+        competition_names = sorted({c["name"] for c in competitions})
+        club_names = sorted({c["name"] for c in clubs})
+        self._competition_slots = {
+            name: _HEADER + i for i, name in enumerate(competition_names)}
+        self._club_slots = {
+            name: _HEADER + len(competition_names) + i
+            for i, name in enumerate(club_names)}
+        layout = repr(
+            (_HEADER, competition_names, club_names, version)).encode()
+        self.name = f"{prefix}-{hashlib.sha1(layout).hexdigest()[:16]}"
+        size = 8 * (_HEADER + len(competition_names) + len(club_names))
+
+        self._thread_lock = threading.Lock()
+        self._lock_fd = os.open(
+            os.path.join(tempfile.gettempdir(), prefix + ".lock"),
+            os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            try:
+                self._segment = _open_segment(self.name, size)
+            except FileExistsError:
+                self._segment = _open_segment(self.name)
+            self._values = self._segment.buf.cast("q")
+        deadline = time.monotonic() + drain_timeout
+        while True:
+            with self._locked():
+                current = os.pread(self._lock_fd, 256, 0).decode() or None
+                if (current == self.name and self._values[_READY]
+                        and not self._values[_RETIRED]):
+                    return
+                if self._drained(current) or time.monotonic() >= deadline:
+                    if seed is not None:
+                        clubs, competitions = seed()
+                    self._seed(competitions, clubs)
+                    os.ftruncate(self._lock_fd, 0)
+                    os.pwrite(self._lock_fd, self.name.encode(), 0)
+                    return
+            time.sleep(0.01)
+
+    def _drained(self, name):
+        """Retire the segment 'name', return True once the bookings
+        taken from it are all committed or given back"""
+        if name is None:
+            return True
+        if name == self.name:
+            values, segment = self._values, None
+        else:
+            try:
+                segment = _open_segment(name)
+            except FileNotFoundError:
+                return True
+            values = segment.buf.cast("q")
+        try:
+            values[_RETIRED] = 1
+            return values[_PENDING] <= 0
+        finally:
+            if segment is not None:
+                values.release()
+                segment.close()
+
+    def _seed(self, competitions, clubs):
+        """Set the counters up from the records, as the current segment"""
+        for competition in competitions:
+            slot = self._competition_slots.get(competition["name"])
+            if slot is not None:
+                self._values[slot] = int(competition["spotsAvailable"])
+        for club in clubs:
+            slot = self._club_slots.get(club["name"])
+            if slot is not None:
+                self._values[slot] = int(club["points"])
+        self._values[_INSTANCE] = secrets.randbits(63)
+        self._values[_GENERATION] += 1
+        self._values[_PENDING] = 0
+        self._values[_RETIRED] = 0
+        self._values[_READY] = 1
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock against other threads and other workers"""
+        with self._thread_lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @property
+    def generation(self):
+        """Number of bookings taken by every worker so far"""
+        return self._values[_GENERATION]
+
+    @property
+    def instance(self):
+        """Random number drawn when the segment was set up, the same for
+        every worker attached to it"""
+        return self._values[_INSTANCE]
+
+    @property
+    def retired(self):
+        """True once another worker set up a segment for newer data"""
+        return bool(self._values[_RETIRED])
+
+    def spots_available(self, competition_name):
+        return self._values[self._competition_slots[competition_name]]
+
+    def points(self, club_name):
+        return self._values[self._club_slots[club_name]]
+
+    def take(self, club_name, bookings):
+        """Take the (competition name, spots) 'bookings' off the
+        competitions and the club points, if they all have enough left
+        and the segment is not retired. Return False, changing nothing,
+        otherwise. Follow with committed() or give_back()."""
+        club = self._club_slots[club_name]
+        slots = [(self._competition_slots[name], spots)
+                 for name, spots in bookings]
+        with self._locked():
+            if (self._values[_RETIRED]
+                    or sum(spots for _, spots in slots) > self._values[club]
+                    or any(spots > self._values[slot]
+                           for slot, spots in slots)):
+                return False
+            for slot, spots in slots:
+                self._values[slot] -= spots
+                self._values[club] -= spots
+            self._values[_GENERATION] += 1
+            self._values[_PENDING] += 1
+        return True
+
+    def committed(self):
+        """The bookings of a take() are in storage"""
+        with self._locked():
+            self._values[_PENDING] -= 1
+
+    def give_back(self, club_name, bookings):
+        """Undo a take(), when the bookings could not be committed"""
+        club = self._club_slots[club_name]
+        with self._locked():
+            for name, spots in bookings:
+                self._values[self._competition_slots[name]] += spots
+                self._values[club] += spots
+            self._values[_GENERATION] += 1
+            self._values[_PENDING] -= 1
+
+    def close(self):
+        self._values.release()
+        self._segment.close()
+        os.close(self._lock_fd)
+
+    def unlink(self):
+        """Remove the segment, once no worker attaches to it any more.
+
+        Workers already attached keep using it until they close it. Each
+        worker may unlink it; the first one does. The lock file is kept,
+        as it is shared by every segment of the prefix.
+        """
+        try:
+            self._segment.unlink()
+        except FileNotFoundError:
+            pass
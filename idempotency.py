@@ -0,0 +1,57 @@
+import threading
+
+from cache import LRUCache
+
+_MISSING = object()
+
+
+class InProgress(Exception):
+    """A request with the same idempotency key is still running"""
+
+
+class IdempotencyCache:
+    """Results by idempotency key, so that a retried request gets the
+    result of the first one instead of running again.
+
+    Results are kept for 'ttl' seconds, at most 'maxsize' of them. A
+    duplicate arriving while the first request still runs waits up to
+    'wait' seconds for its result before InProgress is raised.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, wait=5.0):
+        self.wait = wait
+        self._results = LRUCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._running = {}  # key -> Event set once the first run is over
+
+    def run(self, key, fn, keep=None):
+        """Return (fn(), False), or (stored result, True) for a key
+        already run.
+
+        Only results for which keep(result) is true are stored, so the
+        others (e.g. "please try again") are run again on a retry.
+        """
+        while True:
+            with self._lock:
+                result = self._results.get(key, _MISSING)
+                if result is not _MISSING:
+                    return result, True
+                done = self._running.get(key)
+                if done is None:
+                    done = self._running[key] = threading.Event()
+                    break
+            if not done.wait(self.wait):
+                raise InProgress(key)
+
+        try:
+            result = fn()
+            if keep is None or keep(result):
+                self._results.set(key, result)
+        finally:
+            with self._lock:
+                del self._running[key]
+            done.set()
+        return result, False
+
+    def clear(self):
+        self._results.clear()
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class _Batch:
+    """Records flushed together, and how the flush went"""
+
+    __slots__ = ("lines", "done", "error")
+
+    def __init__(self):
+        self.lines = []
+        self.done = False
+        self.error = None
+
+
+class BookingJournal:
+    """Append-only log of booking records, one JSON object per line.
+
+    Appends are group-committed: the first writer to arrive becomes the
+    leader and writes and fsyncs every pending record at once, while the
+    writers that queued up behind it just wait for that flush. Concurrent
+    bookings therefore share one fsync instead of paying one each.
+    """
+
+    def __init__(self, path, commit_delay=0.0):
+        self.path = Path(path)
+        # Optional pause before a flush, to let more writers join the group
+        self.commit_delay = commit_delay
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._file = None
+        self._batch = _Batch()
+        self._appended = 0  # sequence number of the last appended record
+        # A failed write that could not be cut off left a partial line
+        self._torn = False
+        self._flushing = False
+
+    def append(self, record):
+        """Write 'record' and return once it is durably on disk"""
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            batch = self._batch
+            batch.lines.append(line.encode())
+            self._appended += 1
+            seq = self._appended
+            while not batch.done:
+                if self._flushing:
+                    self._flushed.wait()
+                else:
+                    self._flush()
+            if batch.error is not None:
+                raise OSError("Booking journal write failed") from batch.error
+        return seq
+
+    def _flush(self):
+        """Write and fsync pending records, called with the lock held"""
+        self._flushing = True
+        try:
+            if self.commit_delay:
+                self._lock.release()
+                try:
+                    time.sleep(self.commit_delay)
+                finally:
+                    self._lock.acquire()
+            batch, self._batch = self._batch, _Batch()
+            self._lock.release()
+            try:
+                self._write(b"".join(batch.lines))
+            except BaseException as error:
+                batch.error = error
+                if not isinstance(error, Exception):
+                    raise
+            finally:
+                self._lock.acquire()
+                batch.done = True
+        finally:
+            self._flushing = False
+            self._flushed.notify_all()
+
+    def _write(self, data):
+        """Append 'data' and fsync it. On failure, cut the file back to
+        where it was, so the next batch does not land on a partial line"""
+        if self._file is None:
+            self._file = open(self.path, "ab", buffering=0)
+        fd = self._file.fileno()
+        size = os.fstat(fd).st_size
+        if self._torn:
+            data = b"\n" + data
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        except BaseException:
+            try:
+                os.ftruncate(fd, size)
+            except OSError:
+                # The next batch starts on a new line instead
+                self._torn = True
+            raise
+        self._torn = False
+
+    def replay(self):
+        """Yield the records in the journal, oldest first.
+
+        A torn last line (a crash in the middle of a write) is skipped.
+        """
+        try:
+            fp = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def entries(self, offset=0):
+        """Yield (offset, record) for each line from byte 'offset' on,
+        'offset' being where the line starts so a reader can come back
+        to it. A last line still being written is left out.
+        """
+        try:
+            fp = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with fp:
+            fp.seek(offset)
+            while True:
+                line = fp.readline()
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if record is not None:
+                    yield offset, record
+                offset += len(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
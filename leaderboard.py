@@ -0,0 +1,47 @@
+import bisect
+
+
+class Leaderboard:
+    """Clubs sorted by points, most first, kept sorted as points change.
+
+    Entries are (-points, load order, club) tuples in one sorted list, so
+    a page is a slice and a change of points moves a single entry with a
+    bisect. Every change is one slice assignment, so readers never see a
+    club missing or listed twice.
+    """
+
+    def __init__(self, clubs):
+        self._keys = {}  # id(club) -> its current (-points, load order)
+        entries = []
+        for order, club in enumerate(clubs):
+            key = self._keys[id(club)] = (-club.points, order)
+            entries.append(key + (club,))
+        entries.sort(key=lambda entry: entry[:2])
+        self._entries = entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def page(self, offset=0, limit=None):
+        """Clubs ranked 'offset' + 1 to 'offset' + 'limit'"""
+        stop = None if limit is None else offset + limit
+        return [entry[2] for entry in self._entries[offset:stop]]
+
+    def update(self, club):
+        """Move 'club' to its rank for its current points"""
+        old = self._keys.get(id(club))
+        if old is None:
+            # Not ours, e.g. a record from before a reload
+            return
+        new = self._keys[id(club)] = (-club.points, old[1])
+        entries = self._entries
+        old_index = bisect.bisect_left(entries, old)
+        new_index = bisect.bisect_left(entries, new)
+        entry = new + (club,)
+        if new_index > old_index:
+            # Fewer points: the clubs in between move up one rank
+            entries[old_index:new_index] = (
+                entries[old_index + 1:new_index] + [entry])
+        else:
+            entries[new_index:old_index + 1] = (
+                [entry] + entries[new_index:old_index])
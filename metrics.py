@@ -0,0 +1,101 @@
+import bisect
+import threading
+
+# Upper bounds in seconds, from 1ms to 10s
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """Counts of observed values per bucket, Prometheus style"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket, plus the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, count of values <= it) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+def _format_labels(labels):
+    """Helper method - {a="1",b="2"} from sorted (name, value) pairs"""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class Metrics:
+    """Histograms and counters, exposed in the Prometheus text format.
+
+    Every metric is declared once with its help text, then observed or
+    incremented with any labels. A single lock is held for a few dict
+    and list operations, cheap enough to keep on for every request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> (type, help, buckets, {labels: value})
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        self._metrics[name] = ("histogram", help, buckets, {})
+
+    def counter(self, name, help):
+        self._metrics[name] = ("counter", help, None, {})
+
+    def observe(self, name, value, **labels):
+        _, _, buckets, series = self._metrics[name]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        series = self._metrics[name][3]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series[key] = series.get(key, 0) + amount
+
+    def render(self):
+        """All the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, (kind, help, _, series) in self._metrics.items():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series.items():
+                    if kind == "counter":
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+                        continue
+                    for bound, count in value.cumulative():
+                        bucket_labels = _format_labels(
+                            labels + (("le", _format_bound(bound)),))
+                        lines.append(f"{name}_bucket{bucket_labels} {count}")
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} {value.sum}")
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
@@ -1,18 +1,49 @@
+import bisect
+import hashlib
+import heapq
 import json
+import logging
+import mmap
+import os
+import re
+import secrets
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+import zlib
+from datetime import datetime, timedelta
 from pathlib import Path
 
+from counters import SharedCounters
+from leaderboard import Leaderboard
+
 DATA_FOLDER = "data"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+logger = logging.getLogger(__name__)
 
-def _json_from_file(filename, key):
-    """Helper method - loads JSON from 'filename'
+
+def _data_path(filename):
+    """Helper method - absolute path of 'filename' in the data folder"""
+    return Path(__file__).parent / DATA_FOLDER / filename
+
+
+def _json_from_path(path, key):
+    """Helper method - loads JSON from 'path'
     and return whatever is at the 'key'"""
-    filepath = Path(__file__).parent / DATA_FOLDER / filename
-    with open(filepath) as fp:
+    with open(path) as fp:
         data = json.load(fp)
         return data[key]
 
 
+def _json_from_file(filename, key):
+    """Helper method - loads JSON from 'filename' in the data folder
+    and return whatever is at the 'key'"""
+    return _json_from_path(_data_path(filename), key)
+
+
 def get_clubs():
     """Load clubs from JSON"""
     return _json_from_file("clubs.json", "clubs")
@@ -21,3 +52,1008 @@ def get_clubs():
 def get_competitions():
     """Load competitions from JSON"""
     return _json_from_file("competitions.json", "competitions")
+
+
+def _file_signature(path):
+    """Helper method - (inode, mtime, size) of 'path', None if it is
+    missing. The inode changes when an editor replaces the file."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _parse_date(text):
+    """Helper method - datetime from a competition date, None if invalid"""
+    try:
+        return datetime.strptime(text, DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Record:
+    """Compact record with its fields parsed once, at load time.
+
+    Fields are attributes, but the JSON keys also work as dict keys so
+    the templates can keep using club['points'] and the like.
+    """
+
+    __slots__ = ()
+    # JSON key -> attribute
+    KEYS = {}
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self.KEYS[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.KEYS.keys()
+
+    def to_dict(self):
+        return {key: self[key] for key in self.KEYS}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Club(_Record):
+    __slots__ = ("name", "email", "points")
+    KEYS = {"name": "name", "email": "email", "points": "points"}
+
+    def __init__(self, name, email, points):
+        self.name = name
+        self.email = email
+        self.points = int(points)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["email"], data["points"])
+
+
+class Competition(_Record):
+    __slots__ = ("name", "date", "date_text", "spots_available")
+    KEYS = {"name": "name", "date": "date_text",
+            "spotsAvailable": "spots_available"}
+
+    def __init__(self, name, date_text, spots_available):
+        self.name = name
+        self.date_text = date_text
+        # None when the date is missing or invalid
+        self.date = _parse_date(date_text)
+        self.spots_available = int(spots_available)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data.get("date"), data["spotsAvailable"])
+
+    @classmethod
+    def parsed(cls, name, date_text, date, spots_available):
+        """Competition whose date was already parsed, e.g. in a snapshot"""
+        competition = cls.__new__(cls)
+        competition.name = name
+        competition.date_text = date_text
+        competition.date = date
+        competition.spots_available = spots_available
+        return competition
+
+
+def _index(records, key):
+    """Helper method - map record[key] to record, the first one wins"""
+    index = {}
+    for record in records:
+        index.setdefault(record.get(key), record)
+    return index
+
+
+def _apply_booking(club, competition, spots):
+    """Helper method - take 'spots' off the competition and the club points"""
+    competition.spots_available -= spots
+    club.points -= spots
+
+
+def _booking_record(club_name, bookings):
+    """Helper method - the (competition name, spots) 'bookings' as they
+    are journaled, in one record so a batch is replayed all or nothing"""
+    record = {
+        "club": club_name,
+        "time": datetime.now().isoformat(timespec="seconds"),
+    }
+    if len(bookings) == 1:
+        record["competition"], record["spots"] = bookings[0]
+    else:
+        record["bookings"] = [
+            {"competition": name, "spots": spots} for name, spots in bookings]
+    return record
+
+
+def _record_bookings(record):
+    """Helper method - the (competition name, spots) pairs of a record"""
+    if "bookings" in record:
+        return [(booking["competition"], booking["spots"])
+                for booking in record["bookings"]]
+    return [(record.get("competition"), record["spots"])]
+
+
+class Storage:
+    """Where clubs, competitions and bookings are kept.
+
+    A backend returns fresh records from load(), a cheap value from
+    signature() that changes whenever load() would return something
+    different (None if it never does), and commits bookings with book().
+    """
+
+    def signature(self):
+        raise NotImplementedError
+
+    def load(self):
+        """Return (clubs, competitions) as lists of dicts"""
+        raise NotImplementedError
+
+    def book(self, club_name, bookings):
+        """Commit the (competition name, spots) 'bookings' of a club, all
+        or nothing. Return False if the points or spots are short"""
+        raise NotImplementedError
+
+    def bookings(self, since=None):
+        """Iterate over (cursor, booking) pairs, oldest first, where a
+        booking is a dict with the club, competition, spots and time.
+
+        Passing the opaque cursor of a booking as 'since' resumes right
+        after it. Raise ValueError at once for a cursor that is not one.
+        """
+        raise NotImplementedError
+
+
+class MemoryStorage(Storage):
+    """Static records, never reloaded, with an optional booking journal"""
+
+    def __init__(self, clubs, competitions, journal=None):
+        self.clubs = clubs
+        self.competitions = competitions
+        self.journal = journal
+
+    def signature(self):
+        return None
+
+    def load(self):
+        clubs = [Club.from_dict(club) for club in self.clubs]
+        competitions = [
+            Competition.from_dict(competition)
+            for competition in self.competitions]
+        if self.journal is not None:
+            _replay(self.journal, clubs, competitions)
+        return clubs, competitions
+
+    def book(self, club_name, bookings):
+        if self.journal is not None:
+            self.journal.append(_booking_record(club_name, bookings))
+        return True
+
+    def bookings(self, since=None):
+        # "<offset of the journal line>-<index of the booking in it>"
+        start, last = 0, -1
+        if since:
+            start, last = (int(part) for part in since.split("-"))
+            if start < 0:
+                raise ValueError(f"Invalid cursor {since!r}")
+        if self.journal is None:
+            return iter(())
+        return self._journal_bookings(start, last)
+
+    def _journal_bookings(self, start, last):
+        for offset, record in self.journal.entries(start):
+            for index, (name, spots) in enumerate(_record_bookings(record)):
+                if offset == start and index <= last:
+                    continue
+                yield f"{offset}-{index}", {
+                    "club": record.get("club"),
+                    "competition": name,
+                    "spots": spots,
+                    "time": record.get("time"),
+                }
+
+
+# Snapshot header: magic, format version, SHA-256 of the JSON sources,
+# club count, competition count, text size and CRC-32 of everything after
+# the header. Then the fixed-size club and competition records, whose
+# strings are (offset, length) slices of one UTF-8 text at the end.
+_SNAPSHOT_MAGIC = b"GUDL"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<4sH32sIIII")
+_SNAPSHOT_CLUB = struct.Struct("<IIIIq")
+_SNAPSHOT_COMPETITION = struct.Struct("<IIIIqq")
+# Length of a missing string, and seconds of a missing or invalid date
+_NO_TEXT = 0xFFFFFFFF
+_NO_DATE = -2 ** 63
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+def _source_digest(sources):
+    """Helper method - SHA-256 of the 'sources' file contents"""
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update(len(source).to_bytes(8, "little"))
+        digest.update(source)
+    return digest.digest()
+
+
+def _write_snapshot(path, digest, clubs, competitions):
+    """Helper method - write the records to a binary snapshot at 'path',
+    replacing any previous one atomically"""
+    texts = []
+    size = 0
+
+    def text(value):
+        nonlocal size
+        if value is None:
+            return size, _NO_TEXT
+        if not isinstance(value, str):
+            raise TypeError(f"Cannot snapshot {value!r}")
+        texts.append(value)
+        size += len(value)
+        return size - len(value), len(value)
+
+    body = bytearray()
+    for club in clubs:
+        body += _SNAPSHOT_CLUB.pack(
+            *text(club.name), *text(club.email), club.points)
+    for competition in competitions:
+        seconds = _NO_DATE
+        if competition.date is not None:
+            seconds = (competition.date - _EPOCH) // _SECOND
+        body += _SNAPSHOT_COMPETITION.pack(
+            *text(competition.name), *text(competition.date_text),
+            seconds, competition.spots_available)
+    body += "".join(texts).encode()
+    header = _SNAPSHOT_HEADER.pack(
+        _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, digest, len(clubs),
+        len(competitions), size, zlib.crc32(body))
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as fp:
+            fp.write(header)
+            fp.write(body)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _read_snapshot(path, digest):
+    """Helper method - (clubs, competitions) from the snapshot at 'path',
+    None if it is missing, corrupt or was built from other sources.
+
+    The file is mapped rather than read, so worker processes share its
+    pages in the page cache, and nothing needs parsing: numbers are
+    unpacked as is and dates are seconds since the epoch.
+    """
+    try:
+        with open(path, "rb") as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    with mapped, memoryview(mapped) as view:
+        if len(view) < _SNAPSHOT_HEADER.size:
+            return None
+        (magic, version, source, club_count, competition_count, _,
+         checksum) = _SNAPSHOT_HEADER.unpack_from(view)
+        body = view[_SNAPSHOT_HEADER.size:]
+        if (magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION
+                or source != digest or zlib.crc32(body) != checksum):
+            body.release()
+            return None
+        clubs_end = club_count * _SNAPSHOT_CLUB.size
+        competitions_end = (
+            clubs_end + competition_count * _SNAPSHOT_COMPETITION.size)
+        text = str(body[competitions_end:], "utf-8")
+
+        def field(offset, length):
+            if length == _NO_TEXT:
+                return None
+            return text[offset:offset + length]
+
+        clubs = [
+            Club(field(name, name_length), field(email, email_length),
+                 points)
+            for name, name_length, email, email_length, points
+            in _SNAPSHOT_CLUB.iter_unpack(body[:clubs_end])
+        ]
+        competitions = [
+            Competition.parsed(
+                field(name, name_length), field(date, date_length),
+                None if seconds == _NO_DATE else _EPOCH + seconds * _SECOND,
+                spots)
+            for name, name_length, date, date_length, seconds, spots
+            in _SNAPSHOT_COMPETITION.iter_unpack(
+                body[clubs_end:competitions_end])
+        ]
+        body.release()
+    return clubs, competitions
+
+
+class JsonStorage(MemoryStorage):
+    """The JSON files in the data folder, with bookings in a journal.
+
+    The files are never rewritten; the journal is replayed over them on
+    every load. The signature is the files' (inode, mtime, size).
+
+    With a 'snapshot' path, the parsed records are also saved there in a
+    compact binary form, which later loads map instead of parsing the
+    JSON again for as long as the files' checksum matches.
+    """
+
+    def __init__(self, clubs_path=None, competitions_path=None,
+                 journal=None, snapshot=None):
+        self.paths = (
+            clubs_path or _data_path("clubs.json"),
+            competitions_path or _data_path("competitions.json"),
+        )
+        self.journal = journal
+        self.snapshot = snapshot
+
+    def signature(self):
+        return tuple(_file_signature(path) for path in self.paths)
+
+    def load(self):
+        if self.snapshot is None:
+            self.clubs = _json_from_path(self.paths[0], "clubs")
+            self.competitions = _json_from_path(
+                self.paths[1], "competitions")
+            return super().load()
+
+        # Read once, so the checksum and the records match even if a
+        # file is replaced meanwhile
+        sources = [Path(path).read_bytes() for path in self.paths]
+        digest = _source_digest(sources)
+        records = _read_snapshot(self.snapshot, digest)
+        if records is None:
+            records = self._parse(*sources)
+            try:
+                _write_snapshot(self.snapshot, digest, *records)
+            except (OSError, TypeError, struct.error):
+                # E.g. a number too big for the format: still served
+                # from the JSON, just not any faster
+                pass
+        clubs, competitions = records
+        if self.journal is not None:
+            _replay(self.journal, clubs, competitions)
+        return clubs, competitions
+
+    @staticmethod
+    def _parse(clubs_source, competitions_source):
+        """Records from the contents of the JSON files"""
+        clubs = [Club.from_dict(club)
+                 for club in json.loads(clubs_source)["clubs"]]
+        competitions = [
+            Competition.from_dict(competition)
+            for competition in json.loads(competitions_source)["competitions"]]
+        return clubs, competitions
+
+
+def _replay(journal, clubs, competitions):
+    """Helper method - apply the journaled bookings to the records"""
+    clubs_by_name = _index(clubs, "name")
+    competitions_by_name = _index(competitions, "name")
+    for record in journal.replay():
+        club = clubs_by_name.get(record.get("club"))
+        if club is None:
+            continue
+        for name, spots in _record_bookings(record):
+            competition = competitions_by_name.get(name)
+            if competition is not None:
+                _apply_booking(club, competition, spots)
+
+
+class SqliteStorage(Storage):
+    """A SQLite database in WAL mode, shared by every worker.
+
+    Bookings are a single conditional UPDATE transaction, so two
+    workers can never both pass the points or spots check, and readers
+    never block behind the writer. The database is seeded from 'seed'
+    (the JSON files by default) the first time it is opened. The
+    signature is SQLite's data_version, which changes whenever another
+    connection commits.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS clubs (
+            name TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            points INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS competitions (
+            name TEXT PRIMARY KEY,
+            date TEXT,
+            spots_available INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY,
+            club TEXT NOT NULL,
+            competition TEXT NOT NULL,
+            spots INTEGER NOT NULL,
+            time TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path=None, seed=None, timeout=5.0):
+        self.path = path or _data_path("gudlft.db")
+        self.seed = seed or JsonStorage()
+        # One connection per process, so our own commits do not show up
+        # in data_version and only other workers' bookings force a reload
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            self.path, timeout=timeout, isolation_level=None,
+            check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        with self._lock:
+            self._db.executescript(self.SCHEMA)
+            self._seed()
+
+    def _seed(self):
+        """Import the seed records into an empty database; records it
+        cannot hold, such as two clubs with one name, fail the import"""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._db.execute("SELECT 1 FROM clubs LIMIT 1").fetchone():
+                self._db.execute("ROLLBACK")
+                return
+            clubs, competitions = self.seed.load()
+            self._db.executemany(
+                "INSERT INTO clubs VALUES (?, ?, ?)",
+                [(c.name, c.email, c.points) for c in clubs])
+            self._db.executemany(
+                "INSERT INTO competitions VALUES (?, ?, ?)",
+                [(c.name, c.date_text, c.spots_available)
+                 for c in competitions])
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def signature(self):
+        with self._lock:
+            return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self):
+        with self._lock:
+            clubs = [
+                Club(*row) for row in self._db.execute(
+                    "SELECT name, email, points FROM clubs ORDER BY rowid")
+            ]
+            competitions = [
+                Competition(*row) for row in self._db.execute(
+                    "SELECT name, date, spots_available FROM competitions "
+                    "ORDER BY rowid")
+            ]
+        return clubs, competitions
+
+    def book(self, club_name, bookings):
+        total = sum(spots for _, spots in bookings)
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                booked = self._db.execute(
+                    "UPDATE clubs SET points = points - :total "
+                    "WHERE name = :club AND points >= :total",
+                    {"club": club_name, "total": total}).rowcount
+                for name, spots in bookings:
+                    booked = booked and self._db.execute(
+                        "UPDATE competitions "
+                        "SET spots_available = spots_available - :spots "
+                        "WHERE name = :name AND spots_available >= :spots",
+                        {"name": name, "spots": spots}).rowcount
+                if not booked:
+                    self._db.execute("ROLLBACK")
+                    return False
+                self._db.executemany(
+                    "INSERT INTO bookings (club, competition, spots, time) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(club_name, name, spots, now)
+                     for name, spots in bookings])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return True
+
+    def bookings(self, since=None):
+        # The booking row ID
+        return self._bookings(int(since) if since else 0)
+
+    def _bookings(self, last, batch=500):
+        """Read in batches, so bookings are not held up by a long export"""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT id, club, competition, spots, time FROM bookings "
+                    "WHERE id > ? ORDER BY id LIMIT ?",
+                    (last, batch)).fetchall()
+            if not rows:
+                return
+            for last, club, competition, spots, booked_at in rows:
+                yield str(last), {
+                    "club": club,
+                    "competition": competition,
+                    "spots": spots,
+                    "time": booked_at,
+                }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def normalize(text):
+    """Lower case, without accents and repeated spaces, for matching
+    names however they were typed"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(
+        char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+_WORD = re.compile(r"\w+")
+# Sorts after any word starting with a given prefix
+_LAST_CHAR = chr(0x10FFFF)
+
+
+class SearchIndex:
+    """Names of records, searchable by the start of their words.
+
+    Every word of every normalized name is kept in one sorted list, so
+    the words starting with a prefix are a bisect away. A query collects
+    the records matching its rarest word and checks them against the
+    other words; when even that word is common, walking the records in
+    result order finds the first matches sooner. Either way a query
+    stays far below a scan of every name.
+    """
+
+    def __init__(self, records):
+        self._names = {}  # normalized name -> first record with it
+        self._record_words = []  # position -> words of the record name
+        entries = []
+        for position, record in enumerate(records):
+            name = normalize(record.name)
+            self._names.setdefault(name, record)
+            words = set(_WORD.findall(name))
+            self._record_words.append(words)
+            entries.extend((word, position) for word in words)
+        entries.sort()
+        self._words = [word for word, _ in entries]
+        self._positions = [position for _, position in entries]
+
+    def find(self, name):
+        """The record named 'name', ignoring case, accents and spacing"""
+        return self._names.get(normalize(name))
+
+    def search(self, query, order, ranks, low, high, limit):
+        """Positions of the first 'limit' records among order[low:high]
+        with a word starting with each word of 'query', None if the query
+        has no words. 'ranks' maps a position to its index in 'order'."""
+        words = set(_WORD.findall(normalize(query)))
+        if not words:
+            return None
+        candidates = None
+        for word in words:
+            start = bisect.bisect_left(self._words, word)
+            stop = bisect.bisect_left(self._words, word + _LAST_CHAR, start)
+            if candidates is None or stop - start < len(candidates):
+                candidates = range(start, stop)
+
+        def matches(position):
+            names = self._record_words[position]
+            return all(any(name.startswith(word) for name in names)
+                       for word in words)
+
+        if len(candidates) ** 2 > limit * (high - low):
+            found = []
+            for index in range(low, high):
+                if len(found) == limit:
+                    break
+                if matches(order[index]):
+                    found.append(order[index])
+            return found
+        # A record has an entry per word, and several can start with it
+        found = set()
+        for index in candidates:
+            position = self._positions[index]
+            if low <= ranks[position] < high and matches(position):
+                found.add(ranks[position])
+        return [order[rank] for rank in heapq.nsmallest(limit, found)]
+
+
+_UNLOADED = object()
+
+
+class _Dataset:
+    """Records with their indexes, replaced as a whole on reload"""
+
+    __slots__ = ("clubs", "competitions", "clubs_by_email", "clubs_by_name",
+                 "competitions_by_name", "by_date", "dates", "search_order",
+                 "search_ranks", "leaderboard", "club_search",
+                 "competition_search")
+
+    def __init__(self, clubs, competitions):
+        self.clubs = clubs
+        self.competitions = competitions
+        self.clubs_by_email = _index(clubs, "email")
+        self.clubs_by_name = _index(clubs, "name")
+        self.competitions_by_name = _index(competitions, "name")
+        # Competitions with a valid date, soonest first, for bisect
+        order = sorted(
+            (position for position, competition in enumerate(competitions)
+             if competition.date is not None),
+            key=lambda position: competitions[position].date)
+        self.by_date = [competitions[position] for position in order]
+        self.dates = [competition.date for competition in self.by_date]
+        # Competition positions as search results are sorted, undated
+        # last, and each position's index in that order
+        self.search_order = order + [
+            position for position, competition in enumerate(competitions)
+            if competition.date is None]
+        self.search_ranks = [0] * len(competitions)
+        for rank, position in enumerate(self.search_order):
+            self.search_ranks[position] = rank
+        self.leaderboard = Leaderboard(clubs)
+        self.club_search = SearchIndex(clubs)
+        self.competition_search = SearchIndex(competitions)
+
+
+class Registry:
+    """Clubs and competitions kept in memory with hash indexes.
+
+    Records are loaded once from the storage backend, then only reloaded
+    when its signature changes, so lookups are O(1) and do no file I/O.
+    With 'shared_counters', spots and points are also kept in shared
+    memory so every worker process books against the same numbers; the
+    workers of a deployment share a 'counters_prefix'.
+    'on_load' is called with the seconds each load took.
+
+    By default the signature is checked on every access. With a
+    'watch_interval', a background thread checks it every that many
+    seconds instead and loads new data off the request path; requests
+    keep the data they started with until it is swapped in at once.
+    """
+
+    def __init__(self, storage=None, shared_counters=False, on_load=None,
+                 watch_interval=None, counters_prefix="gudlft"):
+        self.storage = storage or JsonStorage()
+        self.shared_counters = shared_counters
+        self.counters_prefix = counters_prefix
+        self.on_load = on_load
+        self.watch_interval = watch_interval
+        self.counters = None
+        self._synced = None
+        self._signature = _UNLOADED
+        self._failed_signature = None
+        self._watcher_pid = None
+        self._lock = threading.Lock()
+        # Bookings reserved in memory but not committed to storage yet,
+        # which a reload has to wait for, and reloads waiting for them
+        self._committing = 0
+        self._reloading = 0
+        self._idle = threading.Condition(self._lock)
+        # Bumped on every change to the records, with a random prefix
+        # so versions from different processes never compare equal
+        self._instance = secrets.token_hex(4)
+        self._changes = 0
+        self._set_data([], [])
+
+    @classmethod
+    def from_records(cls, clubs, competitions, journal=None):
+        """Registry over static records, never reloaded from disk"""
+        return cls(MemoryStorage(clubs, competitions, journal))
+
+    def _set_data(self, clubs, competitions):
+        self._changes += 1
+        self._data = _Dataset(clubs, competitions)
+
+    def refresh(self):
+        """Reload the records if the storage changed since the last load"""
+        if self.watch_interval:
+            # Threads do not survive a fork, so each worker starts its own
+            if self._watcher_pid != os.getpid():
+                self._start_watcher()
+        elif self._signature is not None:
+            self._check()
+        if self.counters is not None and self._sync_counters():
+            # Another worker loaded newer data: load it too
+            self._reload(self.storage.signature())
+
+    def _check(self):
+        signature = self.storage.signature()
+        if signature != self._signature:
+            self._reload(signature)
+
+    def _start_watcher(self):
+        if self._signature is _UNLOADED:
+            self._check()
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(
+            target=self._watch, daemon=True, name="registry-watcher").start()
+
+    def _watch(self):
+        """Poll the storage signature, keeping the current data when the
+        new one does not load"""
+        while self._signature is not None:
+            time.sleep(self.watch_interval)
+            signature = self.storage.signature()
+            if signature in (self._signature, self._failed_signature):
+                continue
+            try:
+                self._reload(signature)
+            except Exception:
+                self._failed_signature = signature
+                logger.exception("Data not reloaded, keeping the current")
+
+    def _stale(self, signature):
+        """Whether the records need loading again, under the lock"""
+        return (signature != self._signature
+                or self.counters is not None and self.counters.retired)
+
+    def _reload(self, signature):
+        with self._lock:
+            if not self._stale(signature):
+                return
+            # A booking still being committed would be missing from the
+            # load, and lost from memory once the new data is swapped in
+            self._reloading += 1
+            try:
+                while self._committing:
+                    self._idle.wait()
+                if not self._stale(signature):
+                    return
+                start = time.perf_counter()
+                clubs, competitions = self.storage.load()
+                if self.shared_counters:
+                    # Set up from a load done once the bookings taken by
+                    # the other workers are in storage, if it is new
+                    old, self.counters = self.counters, SharedCounters(
+                        competitions, clubs, version=signature,
+                        prefix=self.counters_prefix, seed=self.storage.load)
+                    self._synced = None
+                    if old is not None:
+                        if old.name != self.counters.name:
+                            # Retired: workers still attached keep their
+                            # own mapping, nothing attaches to it again
+                            old.unlink()
+                        old.close()
+                self._set_data(clubs, competitions)
+                self._signature = signature
+            finally:
+                self._reloading -= 1
+                self._idle.notify_all()
+            if self.on_load is not None:
+                self.on_load(time.perf_counter() - start)
+
+    def _sync_counters(self):
+        """Copy the shared spots and points into the records, if they
+        changed since the last copy. Return True if the counters are
+        retired, and the records need loading again."""
+        with self._lock:
+            if self.counters.retired:
+                return True
+            if self.counters.generation == self._synced:
+                return False
+            self._synced = self.counters.generation
+            self._changes += 1
+            for competition in self._data.competitions:
+                competition.spots_available = (
+                    self.counters.spots_available(competition.name))
+            # Few clubs change between two syncs: move only those
+            for club in self._data.clubs:
+                points = self.counters.points(club.name)
+                if points != club.points:
+                    club.points = points
+                    self._data.leaderboard.update(club)
+            return False
+
+    @property
+    def version(self):
+        """Opaque string that changes whenever the records change.
+
+        With shared counters, every worker holds the same records and
+        gives the same version for them. Otherwise the records of each
+        worker drift apart with its bookings, and so does the version.
+        """
+        self.refresh()
+        with self._lock:
+            if self.counters is not None:
+                return f"{self.counters.instance:x}-{self._synced}"
+            return f"{self._instance}-{self._changes}"
+
+    @property
+    def clubs(self):
+        self.refresh()
+        return self._data.clubs
+
+    @property
+    def competitions(self):
+        self.refresh()
+        return self._data.competitions
+
+    def club_by_email(self, email):
+        self.refresh()
+        return self._data.clubs_by_email.get(email)
+
+    def club_by_name(self, name):
+        self.refresh()
+        return self._data.clubs_by_name.get(name)
+
+    def competition_by_name(self, name):
+        self.refresh()
+        return self._data.competitions_by_name.get(name)
+
+    def find_competition(self, name):
+        """Competition named 'name', or else one whose name only differs
+        in case, accents or spacing"""
+        self.refresh()
+        data = self._data
+        return (data.competitions_by_name.get(name)
+                or data.competition_search.find(name))
+
+    def search_competitions(self, query="", start=None, end=None,
+                            limit=20):
+        """Competitions whose name has words starting with the words of
+        'query', dated between 'start' and 'end' if given, soonest first.
+
+        Without a date range, undated matches come last.
+        """
+        self.refresh()
+        data = self._data
+        low = 0 if start is None else bisect.bisect_left(data.dates, start)
+        if end is not None:
+            high = bisect.bisect_right(data.dates, end)
+        elif start is not None:
+            high = len(data.dates)
+        else:
+            high = len(data.search_order)
+        positions = data.competition_search.search(
+            query, data.search_order, data.search_ranks, low, high, limit)
+        if positions is None:
+            positions = data.search_order[low:min(high, low + limit)]
+        return [data.competitions[position] for position in positions]
+
+    def search_clubs(self, query, limit=20):
+        """Clubs whose name has words starting with the words of 'query',
+        in load order"""
+        self.refresh()
+        data = self._data
+        everyone = range(len(data.clubs))
+        positions = data.club_search.search(
+            query, everyone, everyone, 0, len(everyone), limit)
+        return [data.clubs[position] for position in positions or ()]
+
+    @staticmethod
+    def _first_upcoming(data, now):
+        return bisect.bisect_left(data.dates, now or datetime.now())
+
+    def upcoming(self, offset=0, limit=None, now=None):
+        """Competitions that have not started yet, soonest first.
+
+        A bisect on the date index finds the first one, so the cost is
+        O(log n + limit) however many competitions are in the past.
+        """
+        self.refresh()
+        data = self._data
+        start = self._first_upcoming(data, now) + offset
+        stop = None if limit is None else start + limit
+        return data.by_date[start:stop]
+
+    def count_upcoming(self, now=None):
+        self.refresh()
+        data = self._data
+        return len(data.dates) - self._first_upcoming(data, now)
+
+    def leaderboard(self, offset=0, limit=None):
+        """Clubs by points, most first, from rank 'offset' + 1.
+
+        The ranking is kept sorted as bookings come in, so a page costs
+        O(limit) rather than a sort of every club.
+        """
+        self.refresh()
+        return self._data.leaderboard.page(offset, limit)
+
+    def bookings(self, since=None):
+        """(cursor, booking) pairs from the storage, see Storage.bookings"""
+        return self.storage.bookings(since)
+
+    def book(self, club, competition, spots):
+        """Take 'spots' off the competition and the club points"""
+        return self.book_many(club, [(competition, spots)])
+
+    def book_many(self, club, bookings):
+        """Take the (competition, spots) 'bookings' off the competitions
+        and the club points, all or nothing.
+
+        The spots are reserved in memory under the registry lock, then
+        committed to storage outside of it so concurrent bookings can
+        share a flush; reloads wait for those commits. The records are
+        looked up again by name, in case a reload replaced the ones
+        given. Return False, changing nothing, if the points or spots
+        are short here or in storage, or a record is gone.
+        """
+        commit = self.reserve(club, bookings)
+        return commit is not None and commit()
+
+    def reserve(self, club, bookings):
+        """First half of book_many(): reserve the 'bookings' in memory.
+
+        Return None if they cannot be, or else a function to call next,
+        which commits them to storage and returns True, or undoes them
+        and returns False. Reservations can be made one at a time while
+        their commits share a flush.
+        """
+        merged = {}
+        for competition, spots in bookings:
+            merged[competition.name] = merged.get(competition.name, 0) + spots
+        names = list(merged.items())
+        with self._lock:
+            while self._reloading:
+                self._idle.wait()
+            data = self._data
+            club = data.clubs_by_name.get(club.name)
+            items = [(data.competitions_by_name.get(name), spots)
+                     for name, spots in names]
+            if club is None or any(
+                    competition is None for competition, _ in items):
+                return None
+            if self.counters is not None:
+                if not self.counters.take(club.name, names):
+                    return None
+            elif (sum(spots for _, spots in items) > club.points
+                    or any(spots > competition.spots_available
+                           for competition, spots in items)):
+                return None
+            for competition, spots in items:
+                _apply_booking(club, competition, spots)
+            self._data.leaderboard.update(club)
+            self._changes += 1
+            self._committing += 1
+            counters, leaderboard = self.counters, self._data.leaderboard
+
+        def commit():
+            booked = False
+            try:
+                booked = self.storage.book(club.name, names)
+            finally:
+                with self._lock:
+                    if booked and counters is not None:
+                        counters.committed()
+                    if not booked:
+                        if counters is not None:
+                            counters.give_back(club.name, names)
+                        for competition, spots in items:
+                            _apply_booking(club, competition, -spots)
+                        leaderboard.update(club)
+                        self._changes += 1
+                    self._committing -= 1
+                    self._idle.notify_all()
+            return booked
+
+        return commit
@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token buckets by key, to cap how often a club or client can hit a
+    route.
+
+    A bucket holds up to 'burst' tokens and refills at 'rate' tokens per
+    second; every request takes one. A check is O(1). Beyond 'maxsize'
+    buckets the least recently used go first, but only once they have
+    refilled, which loses nothing: a new bucket starts full too. Buckets
+    still refilling are kept, so no one can reset a limit by flooding
+    the limiter with new keys.
+    """
+
+    def __init__(self, maxsize=10000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (tokens, last update, rate, burst)
+        self._buckets = OrderedDict()
+
+    def acquire(self, key, rate, burst):
+        """Take a token from the bucket of 'key'. Return 0 if there was
+        one, or else the seconds until there will be"""
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens, last = bucket[:2]
+                tokens = min(burst, tokens + (now - last) * rate)
+                self._buckets.move_to_end(key)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, rate, burst)
+            while len(self._buckets) > self.maxsize:
+                oldest = next(iter(self._buckets.values()))
+                if not self._refilled(oldest, now):
+                    break
+                self._buckets.popitem(last=False)
+        return wait
+
+    @staticmethod
+    def _refilled(bucket, now):
+        tokens, last, rate, burst = bucket
+        return tokens + (now - last) * rate >= burst
+
+    def __len__(self):
+        return len(self._buckets)
@@ -1,16 +1,415 @@
 from flask import (
-    Flask, flash, redirect, render_template, request, session, url_for
+    Flask, Response, before_render_template, flash, g, jsonify,
+    make_response, redirect, render_template, request, session,
+    template_rendered, url_for
 )
 from datetime import datetime
-
-from provider import get_clubs, get_competitions
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
+import csv
+import functools
+import io
+import itertools
+import json
+import math
+import os
+import secrets
+import threading
+import time
+
+from admission import AdmissionControl, Overloaded
+from cache import LRUCache
+from capture import TrafficCapture
+from idempotency import IdempotencyCache, InProgress
+from journal import BookingJournal
+from metrics import Metrics
+from provider import DATE_FORMAT, JsonStorage, Registry, SqliteStorage
+from ratelimit import RateLimiter
+from sessions import (
+    ServerSideSessionInterface, SessionStore, SqliteSessionStore
+)
+from waitlist import Waitlist
 
 app = Flask(__name__)
 # You should change the secret key in production!
 app.secret_key = "something_special"
+app.config.from_mapping(
+    # "json" (data/*.json plus a booking journal) or "sqlite"
+    STORAGE="json",
+    BOOKING_JOURNAL=os.path.join(app.root_path, "data", "bookings.jsonl"),
+    JOURNAL_COMMIT_DELAY=0.0,
+    # Binary copy of the parsed JSON files for faster starts, None to
+    # always parse the JSON
+    DATA_SNAPSHOT=os.path.join(app.root_path, "data", "snapshot.bin"),
+    SQLITE_DATABASE=os.path.join(app.root_path, "data", "gudlft.db"),
+    # Seconds between two checks for changed data, in a background
+    # thread; 0 to check on every access instead
+    DATA_WATCH_INTERVAL=1.0,
+    # Share spots and points between worker processes in shared memory
+    SHARED_COUNTERS=False,
+    COMPETITIONS_PER_PAGE=20,
+    CLUBS_PER_PAGE=50,
+    # Bookings waiting per competition before new ones are refused with a
+    # 503, 0 to book straight from the request thread
+    ADMISSION_QUEUE_SIZE=64,
+    # Seconds a booking may wait in the queue
+    ADMISSION_TIMEOUT=5.0,
+    # Booking responses kept to answer retries with the same
+    # idempotency key, and for how many seconds
+    IDEMPOTENCY_CACHE_SIZE=1024,
+    IDEMPOTENCY_TTL=3600,
+    # Rate limits as [requests per second, burst], or None: logins per
+    # email and client, bookings per club, and both together per client
+    # IP address.
+    # Behind a proxy every client has the proxy address, so only limit
+    # per client once TRUSTED_PROXIES is set
+    LOGIN_RATE_LIMIT=[0.2, 10],
+    BOOKING_RATE_LIMIT=[1.0, 20],
+    CLIENT_RATE_LIMIT=None,
+    # Rate limited clubs and clients tracked at most
+    RATE_LIMIT_BUCKETS=10000,
+    # Proxies in front of the app whose X-Forwarded-For header gives the
+    # client address, 0 if clients connect directly
+    TRUSTED_PROXIES=0,
+    # Seconds between two waitlist promotion rounds
+    WAITLIST_INTERVAL=5.0,
+    # Seconds clients and proxies may reuse /api/clubs and /api/competitions
+    API_CACHE_MAX_AGE=5,
+    # Rendered competitions and clubs lists kept for the current data
+    RENDER_CACHE_SIZE=256,
+    SESSION_STORE_TTL=86400,
+    SESSION_STORE_SIZE=10000,
+    # SQLite database sharing the sessions between workers, if any
+    SESSION_STORE_DATABASE=None,
+    # Compiled templates shared by the workers started with create_app(),
+    # None for a private folder of the user in the temporary directory
+    TEMPLATE_CACHE_DIR=None,
+    # File to record the requests served to, for benchmarks.replay. It
+    # holds logins and form fields, so only turn it on when needed
+    CAPTURE_LOG=None,
+)
+# Settings can be overridden with GUDLFT_* environment variables
+app.config.from_prefixed_env("GUDLFT")
+if app.config["TRUSTED_PROXIES"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+
+
+def make_storage(config):
+    """Storage backend selected by the STORAGE setting"""
+    if config["STORAGE"] == "sqlite":
+        return SqliteStorage(config["SQLITE_DATABASE"])
+    return JsonStorage(
+        journal=BookingJournal(
+            config["BOOKING_JOURNAL"],
+            commit_delay=config["JOURNAL_COMMIT_DELAY"],
+        ),
+        snapshot=config["DATA_SNAPSHOT"],
+    )
+
+
+def make_session_store(config):
+    """Session store, shared between workers if SESSION_STORE_DATABASE
+    is set"""
+    shared = None
+    if config["SESSION_STORE_DATABASE"]:
+        shared = SqliteSessionStore(
+            config["SESSION_STORE_DATABASE"], config["SESSION_STORE_TTL"])
+    return SessionStore(
+        config["SESSION_STORE_TTL"], config["SESSION_STORE_SIZE"], shared)
+
+
+metrics = Metrics()
+metrics.histogram(
+    "gudlft_request_duration_seconds", "Time spent handling requests")
+metrics.histogram(
+    "gudlft_provider_load_seconds", "Time spent loading the data")
+metrics.histogram(
+    "gudlft_template_render_seconds", "Time spent rendering templates")
+metrics.counter(
+    "gudlft_booking_rejections_total", "Bookings refused, by reason")
+metrics.counter(
+    "gudlft_rate_limited_total", "Requests refused with a 429, by limit")
+metrics.counter(
+    "gudlft_idempotent_replays_total",
+    "Booking responses replayed for a retried idempotency key")
+
+waitlist = Waitlist()
+
+
+def data_loaded(seconds):
+    metrics.observe("gudlft_provider_load_seconds", seconds)
+    # Capacity may have been raised, or points given back
+    waitlist.notify()
+
+
+registry = Registry(
+    make_storage(app.config),
+    shared_counters=app.config["SHARED_COUNTERS"],
+    on_load=data_loaded,
+    watch_interval=app.config["DATA_WATCH_INTERVAL"],
+)
+app.session_interface = ServerSideSessionInterface(
+    make_session_store(app.config))
+fragment_cache = LRUCache(app.config["RENDER_CACHE_SIZE"])
+admission = AdmissionControl(
+    app.config["ADMISSION_QUEUE_SIZE"], app.config["ADMISSION_TIMEOUT"])
+rate_limiter = RateLimiter(app.config["RATE_LIMIT_BUCKETS"])
+capture = (TrafficCapture(app.config["CAPTURE_LOG"])
+           if app.config["CAPTURE_LOG"] else None)
+idempotency = IdempotencyCache(
+    app.config["IDEMPOTENCY_CACHE_SIZE"], app.config["IDEMPOTENCY_TTL"],
+    wait=app.config["ADMISSION_TIMEOUT"])
+
+
+warmed_up = threading.Event()
+
+
+def create_app():
+    """Warm the app up, then return it: serve 'server:create_app()'.
+
+    Templates are compiled up front, through a bytecode cache on disk
+    that workers share, and the data is loaded, so the first requests do
+    not pay for either. /ready answers 200 from then on.
+    """
+    start = time.perf_counter()
+    directory = app.config["TEMPLATE_CACHE_DIR"]
+    if directory:
+        # Compiled templates are loaded as code: keep others out
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        status = os.stat(directory)
+        if status.st_uid != os.getuid() or status.st_mode & 0o077:
+            raise RuntimeError(
+                f"{directory} must be owned by this user and private")
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    registry.refresh()
+    warmed_up.set()
+    app.logger.info("Warmed up in %.3fs", time.perf_counter() - start)
+    return app
+
+
+def render_fragment(template, key, context):
+    """Render 'template' with context(), cached for the data version.
+
+    Any change to the data changes the version, so stale fragments are
+    never served; they just age out of the LRU.
+    """
+    cache_key = (template, registry.version) + key
+    html = fragment_cache.get(cache_key)
+    if html is None:
+        html = Markup(render_template(template, **context()))
+        fragment_cache.set(cache_key, html)
+    return html
+
+
+MAX_SPOTS_PER_BOOKING = 12
+
+
+def booking_error(competition, spots, points, now):
+    """Why 'spots' cannot be booked in 'competition' with 'points' left,
+    as a (reason, message, status) tuple, or None if they can"""
+    if competition.date is None:
+        return "invalid_date", "Competition date is missing or invalid.", 403
+    if competition.date < now:
+        return ("past_competition",
+                "Cannot book spots for past competitions.", 403)
+    if spots <= 0:
+        return "invalid_spots", "Invalid number of spots.", 400
+    if spots > MAX_SPOTS_PER_BOOKING:
+        return ("too_many_spots",
+                f"Cannot book more than {MAX_SPOTS_PER_BOOKING} places.", 403)
+    if spots > points:
+        return "not_enough_points", "Not enough points.", 403
+    if spots > competition.spots_available:
+        return "not_enough_spots", "Not enough spots available.", 403
+    return None
+
+
+def count_rejection(reason):
+    metrics.increment("gudlft_booking_rejections_total", reason=reason)
+
+
+def current_club():
+    """The logged in club, fresh from the registry, or None"""
+    return registry.club_by_email(session.get("email"))
+
+
+def rate_limit(setting, key):
+    """Answer a 429 once key() has used up its tokens under the rate
+    limit in app.config[setting], before the view does any work"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            limit = app.config[setting]
+            if limit:
+                wait = rate_limiter.acquire((setting, key()), *limit)
+                if wait:
+                    metrics.increment(
+                        "gudlft_rate_limited_total", limit=setting)
+                    response = make_response(
+                        "Too many requests, please slow down.", 429)
+                    response.retry_after = math.ceil(wait)
+                    return response
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def client_address():
+    return request.remote_addr
+
+
+def login_attempt():
+    """The email tried from this client address: others cannot use up
+    the logins of a club by trying its email from elsewhere"""
+    return request.form.get("email", ""), client_address()
+
+
+def club_or_client():
+    """The logged in club email, or the client address for anonymous
+    requests: their session is not stored, so has a new ID every time"""
+    return session.get("email") or client_address()
+
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
+def idempotent(view):
+    """Answer a request retried with the same idempotency key (the
+    Idempotency-Key header or the idempotency_key form field) with the
+    stored response of the first one, without booking again.
+
+    Keys are scoped to the logged in club and the route. Responses
+    asking to try again (409 and 5xx) are not stored.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.headers.get("Idempotency-Key")
+               or request.form.get("idempotency_key"))
+        email = session.get("email")
+        if not key or email is None:
+            return view(*args, **kwargs)
+        if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return "Idempotency key is too long.", 400
+
+        def respond():
+            response = make_response(view(*args, **kwargs))
+            return (response.status_code, list(response.headers),
+                    response.get_data())
+
+        try:
+            (status, headers, body), replayed = idempotency.run(
+                (email, request.path, key), respond,
+                keep=lambda result: result[0] < 500 and result[0] != 409)
+        except InProgress:
+            response = make_response(
+                "A request with this idempotency key is in progress.", 409)
+            response.retry_after = 1
+            return response
+        response = Response(body, status, headers)
+        if replayed:
+            metrics.increment("gudlft_idempotent_replays_total")
+            response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    return wrapper
+
+
+def render_summary(club, error=None, page=1):
+    """Render welcome.html with one page of the upcoming competitions"""
+    per_page = app.config["COMPETITIONS_PER_PAGE"]
+    page = max(page, 1)
+    now = datetime.now()
+    # Changes as soon as a competition starts, dropping it from the list
+    upcoming = registry.count_upcoming(now=now)
+    competitions_html = render_fragment(
+        "competitions_list.html",
+        (page, per_page, upcoming),
+        lambda: {
+            "competitions": registry.upcoming(
+                (page - 1) * per_page, per_page, now=now),
+            "page": page,
+            "has_next": upcoming > page * per_page,
+        },
+    )
+    return render_template(
+        "welcome.html",
+        club=club,
+        competitions_html=competitions_html,
+        error=error,
+    )
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_duration(response):
+    if "request_start" in g:
+        metrics.observe(
+            "gudlft_request_duration_seconds",
+            time.perf_counter() - g.request_start,
+            endpoint=request.endpoint or "none",
+        )
+    return response
+
+
+@app.after_request
+def capture_request(response):
+    if capture is not None and "request_start" in g:
+        capture.record(
+            session.get("email"),
+            request.method,
+            request.full_path.rstrip("?"),
+            request.url_rule.rule if request.url_rule else None,
+            response.status_code,
+            time.perf_counter() - g.request_start,
+            form=request.form.to_dict(),
+            json_body=request.get_json(silent=True) if request.is_json
+            else None,
+        )
+    return response
 
-clubs = get_clubs()
-competitions = get_competitions()
+
+def _start_render(sender, template, context, **extra):
+    g.setdefault("render_starts", []).append(time.perf_counter())
+
+
+def _end_render(sender, template, context, **extra):
+    starts = g.get("render_starts")
+    if starts:
+        metrics.observe(
+            "gudlft_template_render_seconds",
+            time.perf_counter() - starts.pop(),
+            template=template.name,
+        )
+
+
+before_render_template.connect(_start_render, app)
+template_rendered.connect(_end_render, app)
+
+
+@app.route("/metrics")
+def show_metrics():
+    """Metrics in the Prometheus text format"""
+    return Response(
+        metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/ready")
+def ready():
+    """Readiness probe: 503 until create_app() has warmed the app up"""
+    if not warmed_up.is_set():
+        response = make_response("Warming up", 503)
+        response.retry_after = 1
+        return response
+    return "Ready"
 
 
 @app.route("/")
@@ -20,21 +419,23 @@ def index():
 
 
 @app.route("/login", methods=["POST"])
+@rate_limit("CLIENT_RATE_LIMIT", client_address)
+@rate_limit("LOGIN_RATE_LIMIT", login_attempt)
 def login():
-    """Use the session object to store the club information across requests"""
+    """The session only keeps the club email, the club is looked up in
+    the registry on every request"""
 
-    clubs = get_clubs()
     if "email" not in request.form or not request.form["email"]:
         return render_template("index.html", error="Email is required."), 400
 
     email = request.form["email"]
-    club_list = [item for item in clubs if item["email"] == email]
-    if not club_list:
+    club = registry.club_by_email(email)
+    if club is None:
         return render_template(
             "index.html", error="Email not found. Please try again."
         ), 401
-    club = club_list[0]
-    session["club"] = club
+    app.session_interface.regenerate(session)
+    session["email"] = club.email
 
     return redirect(url_for("summary"))
 
@@ -42,131 +443,390 @@ def login():
 @app.route("/summary")
 def summary():
     """Custom "homepage" for logged in users"""
-    if "club" not in session:
+    club = current_club()
+    if club is None:
         return "Unauthorized", 401
 
-    club = session["club"]
-
-    return render_template(
-        "welcome.html", club=club, competitions=competitions
-    )
+    for message in waitlist.messages(club.email):
+        flash(message)
+    return render_summary(club, page=request.args.get("page", 1, type=int))
 
 
 @app.route("/book/<competition>")
 def book(competition):
     """Book spots in a competition page"""
-    club = session["club"]
-
-    matching_comps = [
-        comp for comp in competitions
-        if comp["name"] == competition]
+    club = current_club()
+    if club is None:
+        return "Unauthorized", 401
 
-    if not matching_comps:
+    found_competition = registry.find_competition(competition)
+    if found_competition is None:
         flash("Something went wrong-please try again")
         return redirect(url_for("summary"))
-    found_competition = matching_comps[0]
     return render_template(
-        "booking.html", club=club, competition=found_competition)
+        "booking.html", club=club, competition=found_competition,
+        waitlist_position=waitlist.position(
+            found_competition.name, club.email),
+        idempotency_key=secrets.token_urlsafe(16))
 
 
 @app.route("/book", methods=["POST"])
+@rate_limit("CLIENT_RATE_LIMIT", client_address)
+@rate_limit("BOOKING_RATE_LIMIT", club_or_client)
+@idempotent
 def book_spots():
     """This page is only accessible through a POST request (form validation)"""
-    clubs = get_clubs()
-    competitions = get_competitions()
-    club = session["club"]
+    club = current_club()
+    if club is None:
+        return "Unauthorized", 401
 
-    matching_comps = [
-        comp for comp in competitions
-        if comp["name"] == request.form["competition"]
-    ]
+    competition = registry.competition_by_name(request.form["competition"])
+    if competition is None:
+        count_rejection("unknown_competition")
+        return render_summary(club, error="Competition not found."), 404
 
-    competition = matching_comps[0]
+    # Sold out: refuse before doing any work
+    if competition.spots_available <= 0:
+        count_rejection("sold_out")
+        return render_summary(club, error="Not enough spots available."), 403
 
     try:
-        comp_date = datetime.strptime(competition["date"], "%Y-%m-%d %H:%M:%S")
-    except (KeyError, ValueError):
-        return render_template(
-            "welcome.html",
-            club=club,
-            competitions=competitions,
-            error="Competition date is missing or invalid."
-        ), 403
+        spots_required = int(request.form["spots"])
+    except ValueError:
+        count_rejection("invalid_spots")
+        return render_summary(club, error="Invalid number of spots."), 400
+    error = booking_error(
+        competition, spots_required, club.points, datetime.now())
+    if error is not None:
+        reason, message, status = error
+        count_rejection(reason)
+        return render_summary(club, error=message), status
+
+    def reserve():
+        return registry.reserve(club, [(competition, spots_required)])
+
+    # Reservations are queued per competition; the commits run here, so
+    # the ones of a surge share a journal flush
+    if not app.config["ADMISSION_QUEUE_SIZE"]:
+        commit = reserve()
+    else:
+        try:
+            commit = admission.submit(competition.name, reserve)
+        except Overloaded:
+            count_rejection("overloaded")
+            response = make_response(render_summary(
+                club,
+                error="Too many bookings in progress. Please try again."),
+                503)
+            response.retry_after = 1
+            return response
+    if commit is None or not commit():
+        count_rejection("conflict")
+        return render_summary(
+            club,
+            error="Booking could not be completed. Please try again."), 409
 
-    if comp_date < datetime.now():
-        return render_template(
-            "welcome.html",
-            club=club,
-            competitions=competitions,
-            error="Cannot book spots for past competitions."
-        ), 403
+    flash("Great-booking complete!")
+    return render_summary(club)
 
-    spots_required = int(request.form["spots"])
-    club_points = int(club["points"])
 
-    if spots_required <= 0:
-        return render_template(
-            "welcome.html",
-            club=club,
-            competitions=competitions,
-            error="Invalid number of spots."
-        ), 400
+def check_booking(club, competition, spots):
+    """booking_error() for the waitlist promotion"""
+    return booking_error(competition, spots, club.points, datetime.now())
 
-    if spots_required > 12:
-        return render_template(
-            "welcome.html",
-            club=club,
-            competitions=competitions,
-            error="Cannot book more than 12 places."
-        ), 403
 
-    if spots_required > club_points:
-        return render_template(
-            "welcome.html",
-            club=club,
-            competitions=competitions,
-            error="Not enough points."
-        ), 403
+@app.route("/waitlist", methods=["POST"])
+def join_waitlist():
+    """Wait for spots in a competition instead of retrying /book"""
+    club = current_club()
+    if club is None:
+        return "Unauthorized", 401
+
+    competition = registry.competition_by_name(request.form["competition"])
+    if competition is None:
+        return render_summary(club, error="Competition not found."), 404
+
+    try:
+        spots_required = int(request.form["spots"])
+    except ValueError:
+        return render_summary(club, error="Invalid number of spots."), 400
+    error = booking_error(
+        competition, spots_required, club.points, datetime.now())
+    if error is None:
+        return render_summary(
+            club, error="Spots are available, please book them."), 409
+    reason, message, status = error
+    if reason != "not_enough_spots":
+        return render_summary(club, error=message), status
+
+    waitlist.start(
+        lambda: registry, check_booking, app.config["WAITLIST_INTERVAL"])
+    position = waitlist.join(competition.name, club.email, spots_required)
+    flash(f"You are number {position} on the waitlist "
+          f"for {competition.name}.")
+    return render_summary(club)
+
+
+@app.route("/api/bookings", methods=["POST"])
+@rate_limit("CLIENT_RATE_LIMIT", client_address)
+@rate_limit("BOOKING_RATE_LIMIT", club_or_client)
+@idempotent
+def api_bookings():
+    """Book several competitions at once for the logged in club.
+
+    Takes {"bookings": [{"competition": name, "spots": n}, ...]} and
+    applies the same rules as book_spots to the whole batch, which is
+    committed all or nothing. Send an Idempotency-Key header to retry
+    safely.
+    """
+    club = current_club()
+    if club is None:
+        return jsonify(error="Unauthorized"), 401
+
+    payload = request.get_json(silent=True)
+    items = payload.get("bookings") if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify(error="A list of bookings is required."), 400
+
+    # Spots per competition, the same competition may be listed twice
+    bookings = {}
+    for item in items:
+        name = item.get("competition") if isinstance(item, dict) else None
+        spots = item.get("spots") if isinstance(item, dict) else None
+        # JSON numbers only: no 2.9 booked as 2, or true as 1
+        if not isinstance(name, str) or type(spots) is not int:
+            return jsonify(error="Invalid booking.", booking=item), 400
+        # Checked before merging, or -8 would offset 10 in the batch
+        if spots <= 0:
+            count_rejection("invalid_spots")
+            return jsonify(
+                error="Invalid number of spots.", competition=name), 400
+        competition = registry.competition_by_name(name)
+        if competition is None:
+            count_rejection("unknown_competition")
+            return jsonify(
+                error="Competition not found.", competition=name), 404
+        booked_spots = bookings.get(name, (competition, 0))[1]
+        bookings[name] = (competition, booked_spots + spots)
+
+    now = datetime.now()
+    for name, (competition, spots) in bookings.items():
+        error = booking_error(competition, spots, club.points, now)
+        if error is not None:
+            reason, message, status = error
+            count_rejection(reason)
+            return jsonify(error=message, competition=name), status
+    if sum(spots for _, spots in bookings.values()) > club.points:
+        count_rejection("not_enough_points")
+        return jsonify(error="Not enough points."), 403
+
+    if not registry.book_many(club, list(bookings.values())):
+        count_rejection("conflict")
+        return jsonify(
+            error="Booking could not be completed. Please try again."), 409
+
+    return jsonify(
+        points=club.points,
+        bookings=[
+            {"competition": name, "spots": spots,
+             "spotsAvailable": competition.spots_available}
+            for name, (competition, spots) in bookings.items()
+        ],
+    )
+
+
+def cached_json(build):
+    """JSON from build(), tagged with the data version as its ETag.
+
+    A client that already has that version gets a 304 without the data
+    being serialized again.
+    """
+    etag = registry.version
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["API_CACHE_MAX_AGE"]
+    return response
 
-    if spots_required > int(competition["spotsAvailable"]):
-        return render_template(
-            "welcome.html",
-            club=club,
-            competitions=competitions,
-            error="Not enough spots available."
-        ), 403
-
-    competition["spotsAvailable"] = (
-            int(competition["spotsAvailable"]) - spots_required)
-    club["points"] = str(club_points - spots_required)  # Update club points
-    session["club"] = club  # Save updated club in session
-
-    for c in clubs:
-        if c["name"] == club["name"]:
-            c["points"] = club["points"]
-            break
-
-    for comp in competitions:
-        if comp["name"] == competition["name"]:
-            comp["spotsAvailable"] = competition["spotsAvailable"]
-            break
-    flash("Great-booking complete!")
-    return render_template(
-        "welcome.html", club=club, competitions=competitions)
+
+@app.route("/api/clubs")
+def api_clubs():
+    """Points of every club, emails are left out as they are logins"""
+    return cached_json(lambda: {"clubs": [
+        {"name": club.name, "points": club.points}
+        for club in registry.clubs
+    ]})
+
+
+@app.route("/api/competitions")
+def api_competitions():
+    return cached_json(lambda: {"competitions": [
+        competition.to_dict() for competition in registry.competitions
+    ]})
+
+
+MAX_SEARCH_RESULTS = 100
+
+
+def search_limit():
+    """'limit' query argument, 20 by default and MAX_SEARCH_RESULTS at
+    most"""
+    limit = request.args.get("limit", 20, type=int)
+    return min(max(limit, 0), MAX_SEARCH_RESULTS)
+
+
+def parse_day(text, end=False):
+    """datetime from a YYYY-MM-DD or full date query argument, a day
+    being taken up to its last second when it is the 'end' of a range"""
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, DATE_FORMAT)
+    except ValueError:
+        day = datetime.strptime(text, "%Y-%m-%d")
+    return day.replace(hour=23, minute=59, second=59) if end else day
+
+
+@app.route("/api/competitions/search")
+def api_search_competitions():
+    """Competitions by the start of the words of their name (?q=) and
+    date range (?from= and ?to=, inclusive), soonest first"""
+    try:
+        start = parse_day(request.args.get("from"))
+        end = parse_day(request.args.get("to"), end=True)
+    except ValueError:
+        return jsonify(error="Dates must be YYYY-MM-DD."), 400
+    query = request.args.get("q", "")
+    limit = search_limit()
+    return cached_json(lambda: {"competitions": [
+        competition.to_dict() for competition in
+        registry.search_competitions(query, start, end, limit)
+    ]})
+
+
+@app.route("/api/clubs/search")
+def api_search_clubs():
+    """Clubs by the start of the words of their name (?q=)"""
+    query = request.args.get("q", "")
+    limit = search_limit()
+    return cached_json(lambda: {"clubs": [
+        {"name": club.name, "points": club.points}
+        for club in registry.search_clubs(query, limit)
+    ]})
 
 
 @app.route("/clubs")
 def show_clubs():
-    clubs = get_clubs()
-    return render_template("clubs.html", clubs=clubs)
+    """Leaderboard of the clubs by points, one page at a time, or only
+    the first 'top' clubs, at most a page of them"""
+    top = request.args.get("top", type=int)
+    if top is not None:
+        top = min(max(top, 0), app.config["CLUBS_PER_PAGE"])
+        page, per_page = 1, top
+    else:
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = app.config["CLUBS_PER_PAGE"]
+    offset = (page - 1) * per_page
+    clubs_html = render_fragment(
+        "clubs_list.html",
+        (page, per_page, top),
+        lambda: {
+            "clubs": registry.leaderboard(offset, per_page),
+            "first_rank": offset + 1,
+            "page": page,
+            "has_next": (top is None
+                         and len(registry.clubs) > page * per_page),
+        },
+    )
+    return render_template("clubs.html", clubs_html=clubs_html)
+
+
+EXPORT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_lines(export_format, fields, rows):
+    """Yield the (cursor, record) 'rows' one line at a time, as CSV with
+    a header or as NDJSON, each line with the cursor of its row"""
+    if export_format == "ndjson":
+        for cursor, record in rows:
+            yield json.dumps({"cursor": cursor, **record}) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield line(("cursor",) + fields)
+    for cursor, record in rows:
+        yield line([cursor] + [record[field] for field in fields])
+
+
+def export_response(name, fields, rows):
+    """Stream the rows in the format asked for (?format=csv or ndjson),
+    holding one row in memory at a time"""
+    export_format = request.args.get("format", "csv")
+    if export_format not in EXPORT_TYPES:
+        return "Format must be csv or ndjson.", 400
+    response = Response(
+        export_lines(export_format, fields, rows),
+        mimetype=EXPORT_TYPES[export_format])
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename={name}.{export_format}")
+    return response
+
+
+@app.route("/export/clubs")
+def export_clubs():
+    """Clubs and their points, in load order, resumed after the club
+    whose cursor is passed as ?since="""
+    since = max(request.args.get("since", -1, type=int), -1)
+    clubs = itertools.islice(registry.clubs, since + 1, None)
+    return export_response("clubs", ("name", "points"), (
+        (str(position), {"name": club.name, "points": club.points})
+        for position, club in enumerate(clubs, since + 1)
+    ))
+
+
+@app.route("/export/bookings")
+def export_bookings():
+    """Every booking made, oldest first, optionally for one competition
+    (?competition=) and a time range (?from= and ?to=, inclusive),
+    resumed after the booking whose cursor is passed as ?since="""
+    try:
+        start = parse_day(request.args.get("from"))
+        end = parse_day(request.args.get("to"), end=True)
+        bookings = registry.bookings(request.args.get("since"))
+    except ValueError:
+        return "Invalid date or cursor.", 400
+    competition = request.args.get("competition")
+    start = start and start.isoformat(timespec="seconds")
+    end = end and end.isoformat(timespec="seconds")
+
+    def wanted(row):
+        booking = row[1]
+        return ((competition is None
+                 or booking["competition"] == competition)
+                and (start is None or (booking["time"] or "") >= start)
+                and (end is None or (booking["time"] or "") <= end))
+
+    return export_response(
+        "bookings", ("club", "competition", "spots", "time"),
+        filter(wanted, bookings))
 
 
 @app.route("/logout")
 def logout():
     """We delete session data in order to log the user out"""
-    del session["club"]
+    session.clear()
     return redirect(url_for("index"))
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
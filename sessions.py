@@ -0,0 +1,143 @@
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from cache import LRUCache
+
+
+class SqliteSessionStore:
+    """Sessions in a SQLite database, shared by every worker.
+
+    Expired sessions are never read, and are deleted at most every
+    'purge_interval' seconds rather than on every write.
+    """
+
+    def __init__(self, path, ttl, purge_interval=60):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._serializer = TaggedJSONSerializer()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_expires "
+            "ON sessions (expires)")
+        self._purge(time.time())
+
+    def get(self, sid):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM sessions WHERE sid = ? AND expires > ?",
+                (sid, time.time())).fetchone()
+        return None if row is None else self._serializer.loads(row[0])
+
+    def set(self, sid, data):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (sid, self._serializer.dumps(data), now + self.ttl))
+            if now - self._purged >= self.purge_interval:
+                self._purge(now)
+
+    def _purge(self, now):
+        self._purged = now
+        self._db.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def delete(self, sid):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class SessionStore:
+    """Session data by ID: an in-process LRU, optionally in front of a
+    store shared by every worker.
+
+    With a shared store, the local copy is only trusted for 'local_ttl'
+    seconds, since another worker may have changed the session since.
+    """
+
+    def __init__(self, ttl=86400, maxsize=10000, shared=None, local_ttl=5):
+        self.shared = shared
+        self._local = LRUCache(
+            maxsize, ttl if shared is None else min(ttl, local_ttl))
+
+    def get(self, sid):
+        data = self._local.get(sid)
+        if data is None and self.shared is not None:
+            data = self.shared.get(sid)
+            if data is not None:
+                self._local.set(sid, data)
+        return data
+
+    def set(self, sid, data):
+        self._local.set(sid, data)
+        if self.shared is not None:
+            self.shared.set(sid, data)
+
+    def delete(self, sid):
+        self._local.pop(sid)
+        if self.shared is not None:
+            self.shared.delete(sid)
+
+
+class ServerSession(SecureCookieSession):
+    """Session whose data stays on the server, under 'sid'"""
+
+    def __init__(self, sid, initial=None, new=False):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = new
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keep sessions in a SessionStore; the cookie only holds an opaque,
+    random session ID, which is sent again only when it changes."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(sid, data)
+        return ServerSession(secrets.token_urlsafe(16), new=True)
+
+    def regenerate(self, session):
+        """Move the session to a new ID, e.g. on login"""
+        self.store.delete(session.sid)
+        session.sid = secrets.token_urlsafe(16)
+        session.new = session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified:
+            self.store.set(session.sid, dict(session))
+        if session.new:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
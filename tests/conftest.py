@@ -1,5 +1,8 @@
 import pytest
 
+from provider import Registry
+from ratelimit import RateLimiter
+
 
 def mock_clubs():
     """Static data to mock clubs"""
@@ -43,9 +46,16 @@ def mock_data_provider(monkeypatch):
     """
     This fixture will be automatically used in test functions.
 
-    We patch `server.get_clubs`, because that's
-    where the get_clubs function is used.
+    We patch `server.registry`, because that's
+    where clubs and competitions are looked up.
     """
 
-    monkeypatch.setattr("server.get_clubs", mock_clubs)
-    monkeypatch.setattr("server.get_competitions", mock_competitions)
+    monkeypatch.setattr(
+        "server.registry",
+        Registry.from_records(mock_clubs(), mock_competitions()))
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limits(monkeypatch):
+    """Every test starts with full rate limit buckets"""
+    monkeypatch.setattr("server.rate_limiter", RateLimiter())
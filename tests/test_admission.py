@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from admission import AdmissionControl, Overloaded
+
+
+def test_jobs_run_on_one_writer_per_key():
+    admission = AdmissionControl()
+    threads = set()
+    for _ in range(3):
+        admission.submit(
+            "Open", lambda: threads.add(threading.current_thread()))
+    assert len(threads) == 1
+    assert threading.current_thread() not in threads
+
+
+def test_results_and_errors_are_returned():
+    admission = AdmissionControl()
+    assert admission.submit("Open", lambda: 42) == 42
+    with pytest.raises(ZeroDivisionError):
+        admission.submit("Open", lambda: 1 / 0)
+
+
+def test_full_queue_is_refused():
+    admission = AdmissionControl(max_queue=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_job():
+        started.set()
+        release.wait()
+
+    # Holds the writer, then one job fills the queue
+    holder = threading.Thread(
+        target=admission.submit, args=("Open", blocking_job))
+    holder.start()
+    started.wait()
+    waiting = threading.Thread(
+        target=admission.submit, args=("Open", lambda: None))
+    waiting.start()
+    while admission.pending("Open") < 1:
+        pass
+    with pytest.raises(Overloaded):
+        admission.submit("Open", lambda: None)
+    # Another competition has its own queue
+    assert admission.submit("Cup", lambda: "booked") == "booked"
+    release.set()
+    holder.join()
+    waiting.join()
+
+
+def test_job_dropped_after_timeout_never_runs():
+    admission = AdmissionControl(timeout=0.05)
+    release = threading.Event()
+    ran = []
+    holder = threading.Thread(
+        target=admission.submit, args=("Open", release.wait))
+    holder.start()
+    with pytest.raises(Overloaded):
+        admission.submit("Open", lambda: ran.append(True))
+    release.set()
+    holder.join()
+    assert admission.submit("Open", lambda: "done") == "done"
+    assert ran == []
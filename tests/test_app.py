@@ -1,6 +1,26 @@
 from flask import request
+import json
+import pytest
 from unittest.mock import patch
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from admission import Overloaded
+from journal import BookingJournal
+from provider import Registry
+from ratelimit import RateLimiter
+import server
 from server import app
+from waitlist import Waitlist
+from tests.conftest import mock_clubs, mock_competitions
+
+
+def use_data(clubs=None, competitions=None):
+    """Serve static clubs and competitions from the server registry"""
+    if clubs is None:
+        clubs = mock_clubs()
+    if competitions is None:
+        competitions = mock_competitions()
+    return patch("server.registry", Registry.from_records(clubs, competitions))
 
 
 def test_homepage():
@@ -49,6 +69,21 @@ def test_login_empty_email():
         assert b"Email is required" in resp.data
 
 
+def test_session_cookie_only_holds_an_id():
+    with app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        cookie = c.get_cookie("session")
+        assert "john@simplylift.co" not in cookie.value
+        assert len(cookie.value) < 32
+
+
+def test_session_points_are_never_stale():
+    with use_data() as registry, app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        registry.club_by_email("john@simplylift.co").points = 3
+        assert "Points available: 3" in c.get("/summary").data.decode()
+
+
 def test_protected_route_without_login():
     """Test accessing a protected route without authentication"""
     with app.test_client() as c:
@@ -61,11 +96,10 @@ def test_book_competition_not_found():
     clubs = [{"name": "Test Club", "email": "test@club.com", "points": "10"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "5"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions), \
+    with use_data(clubs, competitions), \
          app.test_client() as client:
         with client.session_transaction() as sess:
-            sess["club"] = clubs[0]
+            sess["email"] = clubs[0]["email"]
         resp = client.get("/book/Nonexistent Competition",
                           follow_redirects=True)
         assert b"Something went wrong-please try again" in resp.data
@@ -73,10 +107,9 @@ def test_book_competition_not_found():
 
 def test_logout():
     clubs = [{"name": "Test Club", "email": "test@club.com", "points": "10"}]
-    with patch("server.get_clubs",
-               return_value=clubs), app.test_client() as client:
+    with use_data(clubs), app.test_client() as client:
         with client.session_transaction() as sess:
-            sess["club"] = clubs[0]
+            sess["email"] = clubs[0]["email"]
         resp = client.get("/logout", follow_redirects=True)
         assert resp.status_code == 200
         assert b"Welcome to the GUDLFT Registration Portal!" in resp.data
@@ -88,8 +121,7 @@ def test_redeem_more_points_than_available():
               "email": "admin@irontemple.com", "points": "2"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "5"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions):
+    with use_data(clubs, competitions) as registry:
         with app.test_client() as c:
             c.post("/login", data={"email": "admin@irontemple.com"},
                    follow_redirects=True)
@@ -99,8 +131,9 @@ def test_redeem_more_points_than_available():
             )
             assert resp.status_code == 403
             assert "Not enough points." in resp.data.decode()
-            assert clubs[0]["points"] == "2"
-            assert competitions[0]["spotsAvailable"] == "5"
+            assert registry.club_by_email(clubs[0]["email"]).points == 2
+            assert registry.competition_by_name(
+                competitions[0]["name"]).spots_available == 5
 
 
 def test_book_zero_spots():
@@ -109,8 +142,7 @@ def test_book_zero_spots():
               "email": "john@simplylift.co", "points": "100"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "25"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions):
+    with use_data(clubs, competitions) as registry:
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
@@ -118,8 +150,20 @@ def test_book_zero_spots():
                           "competition": "Spring Festival", "spots": "0"})
             assert resp.status_code == 400
             assert "Invalid number of spots." in resp.data.decode()
-            assert clubs[0]["points"] == "100"
-            assert competitions[0]["spotsAvailable"] == "25"
+            assert registry.club_by_email(clubs[0]["email"]).points == 100
+            assert registry.competition_by_name(
+                competitions[0]["name"]).spots_available == 25
+
+
+def test_book_spots_that_are_not_a_number():
+    with use_data(*booking_data()) as registry, app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        for spots in ("", "abc", "1.5"):
+            resp = c.post("/book", data={"competition": "Spring Festival",
+                                         "spots": spots})
+            assert resp.status_code == 400
+            assert "Invalid number of spots." in resp.data.decode()
+        assert registry.club_by_name("Simply Lift").points == 10
 
 
 def test_book_more_spots_than_available():
@@ -128,8 +172,7 @@ def test_book_more_spots_than_available():
               "email": "john@simplylift.co", "points": "100"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "5"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions):
+    with use_data(clubs, competitions) as registry:
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
@@ -137,8 +180,9 @@ def test_book_more_spots_than_available():
                           "competition": "Spring Festival", "spots": "6"})
             assert resp.status_code == 403
             assert "Not enough spots available." in resp.data.decode()
-            assert clubs[0]["points"] == "100"
-            assert competitions[0]["spotsAvailable"] == "5"
+            assert registry.club_by_email(clubs[0]["email"]).points == 100
+            assert registry.competition_by_name(
+                competitions[0]["name"]).spots_available == 5
 
 
 def test_book_exact_points():
@@ -147,8 +191,7 @@ def test_book_exact_points():
               "email": "john@simplylift.co", "points": "12"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "25"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions):
+    with use_data(clubs, competitions):
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
@@ -164,8 +207,7 @@ def test_book_fewer_points():
               "email": "john@simplylift.co", "points": "12"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "25"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions):
+    with use_data(clubs, competitions):
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
@@ -181,8 +223,7 @@ def test_book_more_than_12_spots():
               "email": "john@simplylift.co", "points": "12"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "25"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions):
+    with use_data(clubs, competitions) as registry:
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
@@ -190,8 +231,9 @@ def test_book_more_than_12_spots():
                           "competition": "Spring Festival", "spots": "13"})
             assert resp.status_code == 403
             assert "Cannot book more than 12 places." in resp.data.decode()
-            assert clubs[0]["points"] == "12"
-            assert competitions[0]["spotsAvailable"] == "25"
+            assert registry.club_by_email(clubs[0]["email"]).points == 12
+            assert registry.competition_by_name(
+                competitions[0]["name"]).spots_available == 25
 
 
 def test_book_exactly_12_spots():
@@ -199,8 +241,7 @@ def test_book_exactly_12_spots():
               "email": "john@simplylift.co", "points": "12"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "25"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions):
+    with use_data(clubs, competitions):
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
@@ -215,16 +256,16 @@ def test_book_past_competition():
               "email": "john@simplylift.co", "points": "12"}]
     competitions = [{"name": "Fall Classic",
                      "date": "2020-10-22 13:30:00", "spotsAvailable": "13"}]
-    with patch("server.get_competitions", return_value=competitions), \
-         patch("server.get_clubs", return_value=clubs):
+    with use_data(clubs, competitions) as registry:
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
             resp = c.post("/book", data={"club": "Simply Lift",
                           "competition": "Fall Classic", "spots": "1"})
             assert resp.status_code == 403
-            assert clubs[0]["points"] == "12"
-            assert competitions[0]["spotsAvailable"] == "13"
+            assert registry.club_by_email(clubs[0]["email"]).points == 12
+            assert registry.competition_by_name(
+                competitions[0]["name"]).spots_available == 13
 
 
 def test_book_today_competition():
@@ -232,8 +273,7 @@ def test_book_today_competition():
               "email": "john@simplylift.co", "points": "8"}]
     competitions = [{"name": "Winter Cup",
                      "date": "2025-11-19 20:00:00", "spotsAvailable": "13"}]
-    with patch("server.get_competitions", return_value=competitions), \
-         patch("server.get_clubs", return_value=clubs):
+    with use_data(clubs, competitions):
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
@@ -247,8 +287,7 @@ def test_book_future_competition():
               "email": "john@simplylift.co", "points": "12"}]
     competitions = [{"name": "Spring Festival",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "25"}]
-    with patch("server.get_competitions", return_value=competitions), \
-         patch("server.get_clubs", return_value=clubs):
+    with use_data(clubs, competitions):
         with app.test_client() as c:
             c.post("/login", data={"email": "john@simplylift.co"},
                    follow_redirects=True)
@@ -262,11 +301,10 @@ def test_booking_deducts_points():
               "email": "test@club.com", "points": "10"}]
     competitions = [{"name": "Test Competition",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "5"}]
-    with patch("server.get_clubs", return_value=clubs), \
-         patch("server.get_competitions", return_value=competitions), \
+    with use_data(clubs, competitions), \
          app.test_client() as client:
         with client.session_transaction() as sess:
-            sess["club"] = clubs[0]
+            sess["email"] = clubs[0]["email"]
 
         client.post(
             "/book",
@@ -274,8 +312,8 @@ def test_booking_deducts_points():
             follow_redirects=True,
         )
 
-        with client.session_transaction() as sess:
-            assert int(sess["club"]["points"]) == 7
+        resp = client.get("/summary")
+        assert "Points available: 7" in resp.data.decode()
 
 
 def test_booking_exact_points_leaves_zero():
@@ -284,13 +322,10 @@ def test_booking_exact_points_leaves_zero():
     competitions = [{"name": "Test Competition",
                      "date": "2099-01-01 10:00:00", "spotsAvailable": "5"}]
 
-    with patch("server.get_clubs",
-               return_value=clubs), \
-         patch("server.get_competitions",
-               return_value=competitions), \
+    with use_data(clubs, competitions), \
          app.test_client() as client:
         with client.session_transaction() as sess:
-            sess["club"] = clubs[0]
+            sess["email"] = clubs[0]["email"]
 
         client.post(
             "/book",
@@ -298,8 +333,8 @@ def test_booking_exact_points_leaves_zero():
             follow_redirects=True,
         )
 
-        with client.session_transaction() as sess:
-            assert int(sess["club"]["points"]) == 0
+        resp = client.get("/summary")
+        assert "Points available: 0" in resp.data.decode()
 
 
 def test_clubs_page_loads():
@@ -313,10 +348,7 @@ def test_clubs_page_displays_clubs():
         {"name": "Alpha Club", "email": "alpha@club.com", "points": "10"},
         {"name": "Beta Club", "email": "beta@club.com", "points": "5"},
     ]
-    with (patch(
-            "server.get_clubs",
-            return_value=clubs),
-            app.test_client() as client):
+    with use_data(clubs), app.test_client() as client:
         resp = client.get("/clubs")
         data = resp.data.decode()
         assert "Alpha Club" in data
@@ -325,11 +357,499 @@ def test_clubs_page_displays_clubs():
         assert "5" in data
 
 
+def test_clubs_page_ranks_clubs_by_points():
+    clubs = [
+        {"name": f"Club {n:02}", "email": f"club{n}@club.com",
+         "points": str(n)}
+        for n in range(1, 61)
+    ]
+    with use_data(clubs), app.test_client() as client:
+        first = client.get("/clubs").data.decode()
+        assert first.index("Club 60") < first.index("Club 59")
+        assert "Club 11" in first and "Club 10" not in first
+        assert "page=2" in first
+        second = client.get("/clubs?page=2").data.decode()
+        assert "Club 10" in second and "Club 11" not in second
+        assert '<ol start="51">' in second
+        top = client.get("/clubs?top=3").data.decode()
+        assert "Club 58" in top and "Club 57" not in top
+        assert "page=2" not in top
+        # Never more than a page
+        top = client.get("/clubs?top=100000000").data.decode()
+        assert "Club 11" in top and "Club 10" not in top
+
+
+def test_clubs_page_follows_bookings():
+    clubs, competitions = booking_data()
+    clubs.append({"name": "Iron Temple",
+                  "email": "admin@irontemple.com", "points": "8"})
+    with use_data(clubs, competitions), app.test_client() as c:
+        data = c.get("/clubs").data.decode()
+        assert data.index("Simply Lift") < data.index("Iron Temple")
+        c.post("/login", data={"email": "john@simplylift.co"})
+        c.post("/book", data={"competition": "Spring Festival",
+                              "spots": "3"})
+        data = c.get("/clubs").data.decode()
+        assert data.index("Iron Temple") < data.index("Simply Lift")
+
+
 def test_clubs_page_no_clubs():
-    with (patch(
-            "server.get_clubs",
-            return_value=[]),
-            app.test_client() as client):
+    with use_data([]), app.test_client() as client:
         resp = client.get("/clubs")
         data = resp.data.decode()
         assert "Clubs and Points" in data
+
+
+def test_summary_lists_upcoming_competitions_only():
+    competitions = [
+        {"name": "Fall Classic",
+         "date": "2020-10-22 13:30:00", "spotsAvailable": "13"},
+        {"name": "Spring Festival",
+         "date": "2099-03-27 10:00:00", "spotsAvailable": "25"},
+    ]
+    with use_data(competitions=competitions), app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        data = c.get("/summary").data.decode()
+        assert "Spring Festival" in data
+        assert "Fall Classic" not in data
+
+
+def test_summary_pages_through_competitions():
+    competitions = [
+        {"name": f"Event {n:02}",
+         "date": f"2099-01-{n:02} 10:00:00", "spotsAvailable": "5"}
+        for n in range(1, 26)
+    ]
+    with use_data(competitions=competitions), app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        first = c.get("/summary").data.decode()
+        second = c.get("/summary?page=2").data.decode()
+        assert "Event 20" in first and "Event 21" not in first
+        assert "Event 21" in second and "Event 25" in second
+        assert "page=2" in first and "page=1" in second
+
+
+def booking_data():
+    """A club with 10 points and two upcoming competitions"""
+    clubs = [{"name": "Simply Lift",
+              "email": "john@simplylift.co", "points": "10"}]
+    competitions = [
+        {"name": "Spring Festival",
+         "date": "2099-01-01 10:00:00", "spotsAvailable": "25"},
+        {"name": "Summer Slam",
+         "date": "2099-07-01 10:00:00", "spotsAvailable": "3"},
+    ]
+    return clubs, competitions
+
+
+def test_api_bookings():
+    with use_data(*booking_data()) as registry, app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.post("/api/bookings", json={"bookings": [
+            {"competition": "Spring Festival", "spots": 4},
+            {"competition": "Summer Slam", "spots": 3},
+        ]})
+        assert resp.status_code == 200
+        assert resp.json["points"] == 3
+        assert resp.json["bookings"][1] == {
+            "competition": "Summer Slam", "spots": 3, "spotsAvailable": 0}
+        assert registry.competition_by_name(
+            "Spring Festival").spots_available == 21
+
+
+def test_api_bookings_all_or_nothing():
+    with use_data(*booking_data()) as registry, app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.post("/api/bookings", json={"bookings": [
+            {"competition": "Spring Festival", "spots": 2},
+            {"competition": "Summer Slam", "spots": 4},
+        ]})
+        assert resp.status_code == 403
+        assert resp.json == {"error": "Not enough spots available.",
+                             "competition": "Summer Slam"}
+        assert registry.club_by_email("john@simplylift.co").points == 10
+        assert registry.competition_by_name(
+            "Spring Festival").spots_available == 25
+
+
+def test_api_bookings_checks_points_for_the_whole_batch():
+    with use_data(*booking_data()), app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.post("/api/bookings", json={"bookings": [
+            {"competition": "Spring Festival", "spots": 8},
+            {"competition": "Summer Slam", "spots": 3},
+        ]})
+        assert resp.status_code == 403
+        assert resp.json["error"] == "Not enough points."
+
+
+def test_api_bookings_caps_spots_per_competition():
+    clubs, competitions = booking_data()
+    clubs[0]["points"] = "20"
+    with use_data(clubs, competitions), app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.post("/api/bookings", json={"bookings": [
+            {"competition": "Spring Festival", "spots": 7},
+            {"competition": "Spring Festival", "spots": 6},
+        ]})
+        assert resp.status_code == 403
+        assert "Cannot book more than 12 places." in resp.json["error"]
+
+
+def test_api_bookings_invalid_requests():
+    with use_data(*booking_data()), app.test_client() as c:
+        assert c.post("/api/bookings", json={"bookings": []}).status_code \
+            == 401
+        c.post("/login", data={"email": "john@simplylift.co"})
+        assert c.post("/api/bookings", json={}).status_code == 400
+        for item in ({"competition": "Spring Festival", "spots": "many"},
+                     {"competition": "Spring Festival", "spots": "2"},
+                     {"competition": "Spring Festival", "spots": 2.9},
+                     {"competition": "Spring Festival", "spots": True},
+                     {"competition": ["Spring Festival"], "spots": 1},
+                     {"competition": "Spring Festival"},
+                     "Spring Festival"):
+            resp = c.post("/api/bookings", json={"bookings": [item]})
+            assert resp.status_code == 400
+            assert resp.get_json()["error"] == "Invalid booking."
+        resp = c.post("/api/bookings", json={"bookings": [
+            {"competition": "Spring Festival", "spots": 10},
+            {"competition": "Spring Festival", "spots": -8}]})
+        assert resp.status_code == 400
+        assert resp.get_json()["error"] == "Invalid number of spots."
+        assert c.post("/api/bookings", json={"bookings": [
+            {"competition": "Nowhere", "spots": 1}]}).status_code == 404
+
+
+def test_api_clubs():
+    with app.test_client() as c:
+        resp = c.get("/api/clubs")
+        assert resp.status_code == 200
+        assert resp.json["clubs"][0] == {"name": "Simply Lift", "points": 13}
+        assert "email" not in resp.json["clubs"][0]
+        assert resp.headers["Cache-Control"] == "public, max-age=5"
+
+
+def test_api_competitions_conditional_get():
+    with use_data(*booking_data()) as registry, app.test_client() as c:
+        resp = c.get("/api/competitions")
+        assert resp.json["competitions"][1] == {
+            "name": "Summer Slam", "date": "2099-07-01 10:00:00",
+            "spotsAvailable": 3}
+        etag = resp.headers["ETag"]
+
+        resp = c.get("/api/competitions", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.data == b""
+
+        registry.book(registry.club_by_name("Simply Lift"),
+                      registry.competition_by_name("Summer Slam"), 1)
+        resp = c.get("/api/competitions", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+
+
+def test_clubs_list_is_rendered_once_per_data_version():
+    with use_data() as registry, \
+         patch("server.render_template",
+               wraps=server.render_template) as render, \
+         app.test_client() as c:
+        c.get("/clubs")
+        c.get("/clubs")
+        rendered = [call.args[0] for call in render.call_args_list]
+        assert rendered.count("clubs_list.html") == 1
+
+        registry.book(registry.club_by_name("Simply Lift"),
+                      registry.competition_by_name("Spring Festival"), 1)
+        assert "Simply Lift: 12 points" in c.get("/clubs").data.decode()
+
+
+def test_metrics_endpoint():
+    with use_data(*booking_data()), app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        c.post("/book", data={"competition": "Summer Slam", "spots": "4"})
+        resp = c.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/plain"
+        data = resp.data.decode()
+        assert ('gudlft_request_duration_seconds_count{endpoint="book_spots"}'
+                in data)
+        assert ('gudlft_template_render_seconds_count'
+                '{template="welcome.html"}' in data)
+        assert ('gudlft_booking_rejections_total{reason="not_enough_spots"}'
+                in data)
+
+
+def test_booking_refused_when_overloaded():
+    class Saturated:
+        def submit(self, key, job):
+            raise Overloaded(key)
+
+    with use_data(*booking_data()) as registry, \
+         patch("server.admission", Saturated()), \
+         app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.post("/book", data={"competition": "Summer Slam",
+                                     "spots": "1"})
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "1"
+        assert registry.competition_by_name(
+            "Summer Slam").spots_available == 3
+
+
+def test_booking_sold_out_competition_is_refused():
+    clubs, competitions = booking_data()
+    competitions[1]["spotsAvailable"] = "0"
+    with use_data(clubs, competitions), app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.post("/book", data={"competition": "Summer Slam",
+                                     "spots": "1"})
+        assert resp.status_code == 403
+        assert "Not enough spots available." in resp.data.decode()
+
+
+def test_join_waitlist_when_sold_out():
+    clubs, competitions = booking_data()
+    competitions[1]["spotsAvailable"] = "0"
+    with use_data(clubs, competitions) as registry, \
+         patch("server.waitlist", Waitlist()) as waitlist, \
+         patch.object(Waitlist, "start"), \
+         app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.get("/summary")
+        assert "Join the waitlist" in resp.data.decode()
+        resp = c.post("/waitlist", data={"competition": "Summer Slam",
+                                         "spots": "2"})
+        assert resp.status_code == 200
+        assert "You are number 1 on the waitlist" in resp.data.decode()
+        resp = c.get("/book/Summer Slam")
+        assert "You are number 1 on the waitlist." in resp.data.decode()
+
+        registry.competition_by_name("Summer Slam").spots_available = 2
+        assert waitlist.promote(registry, server.check_booking) == 1
+        resp = c.get("/summary")
+        assert "from the waitlist!" in resp.data.decode()
+        assert registry.club_by_name("Simply Lift").points == 8
+
+
+def test_join_waitlist_refused_when_spots_are_available():
+    with use_data(*booking_data()), \
+         patch("server.waitlist", Waitlist()) as waitlist, \
+         app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.post("/waitlist", data={"competition": "Summer Slam",
+                                         "spots": "2"})
+        assert resp.status_code == 409
+        resp = c.post("/waitlist", data={"competition": "Summer Slam",
+                                         "spots": "11"})
+        assert resp.status_code == 403
+        assert "Not enough points." in resp.data.decode()
+        for spots in ("", "two", "1.5"):
+            resp = c.post("/waitlist", data={"competition": "Summer Slam",
+                                             "spots": spots})
+            assert resp.status_code == 400
+            assert "Invalid number of spots." in resp.data.decode()
+        assert waitlist.position("Summer Slam", "john@simplylift.co") is None
+
+
+def test_book_retried_with_idempotency_key_books_once():
+    with use_data(*booking_data()) as registry, app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.get("/book/Spring Festival")
+        assert 'name="idempotency_key"' in resp.data.decode()
+        form = {"competition": "Spring Festival", "spots": "2",
+                "idempotency_key": "retry-book-1"}
+        first = c.post("/book", data=form)
+        retry = c.post("/book", data=form)
+        assert first.status_code == retry.status_code == 200
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.data == first.data
+        assert registry.club_by_name("Simply Lift").points == 8
+        # A new key books again
+        c.post("/book", data=dict(form, idempotency_key="retry-book-2"))
+        assert registry.club_by_name("Simply Lift").points == 6
+
+
+def test_api_bookings_retried_with_idempotency_key_books_once():
+    with use_data(*booking_data()) as registry, app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        payload = {"bookings": [{"competition": "Summer Slam", "spots": 1}]}
+        headers = {"Idempotency-Key": "retry-api-1"}
+        first = c.post("/api/bookings", json=payload, headers=headers)
+        retry = c.post("/api/bookings", json=payload, headers=headers)
+        assert retry.get_json() == first.get_json()
+        assert "Idempotent-Replayed" not in first.headers
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert registry.competition_by_name(
+            "Summer Slam").spots_available == 2
+
+
+def test_api_search_competitions():
+    with use_data(*booking_data()), app.test_client() as c:
+        resp = c.get("/api/competitions/search?q=sum")
+        assert [item["name"] for item in resp.get_json()["competitions"]] == [
+            "Summer Slam"]
+        resp = c.get("/api/competitions/search?from=2099-01-01&to=2099-01-01")
+        assert [item["name"] for item in resp.get_json()["competitions"]] == [
+            "Spring Festival"]
+        resp = c.get("/api/competitions/search?q=s&limit=1")
+        assert len(resp.get_json()["competitions"]) == 1
+        resp = c.get("/api/competitions/search?from=next-week")
+        assert resp.status_code == 400
+
+
+def test_api_search_clubs_hides_emails():
+    with app.test_client() as c:
+        resp = c.get("/api/clubs/search?q=lift")
+        assert resp.get_json()["clubs"] == [
+            {"name": "Simply Lift", "points": 13},
+            {"name": "She Lifts", "points": 12},
+        ]
+
+
+def test_book_page_finds_competition_ignoring_case():
+    with use_data(*booking_data()), app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        resp = c.get("/book/summer slam")
+        assert resp.status_code == 200
+        assert 'value="Summer Slam"' in resp.data.decode()
+
+
+def test_export_clubs_streams_csv_and_ndjson():
+    with app.test_client() as c:
+        resp = c.get("/export/clubs")
+        assert resp.is_streamed
+        assert resp.mimetype == "text/csv"
+        assert resp.data.decode().splitlines() == [
+            "cursor,name,points",
+            "0,Simply Lift,13",
+            "1,Iron Temple,4",
+            "2,She Lifts,12",
+        ]
+        resp = c.get("/export/clubs?format=ndjson&since=1")
+        assert resp.data.decode().splitlines() == [
+            '{"cursor": "2", "name": "She Lifts", "points": 12}']
+        assert c.get("/export/clubs?format=xml").status_code == 400
+
+
+def test_export_bookings_filters_and_resumes(tmp_path):
+    clubs, competitions = booking_data()
+    journal = BookingJournal(tmp_path / "bookings.jsonl")
+    registry = Registry.from_records(clubs, competitions, journal)
+    with patch("server.registry", registry), app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        for name, spots in (("Spring Festival", "1"), ("Summer Slam", "2"),
+                            ("Spring Festival", "3")):
+            c.post("/book", data={"competition": name, "spots": spots})
+
+        rows = [json.loads(line) for line in c.get(
+            "/export/bookings?format=ndjson").data.decode().splitlines()]
+        assert [row["spots"] for row in rows] == [1, 2, 3]
+        resp = c.get("/export/bookings?competition=Spring Festival")
+        lines = resp.data.decode().splitlines()
+        assert lines[0] == "cursor,club,competition,spots,time"
+        assert [line.split(",")[3] for line in lines[1:]] == ["1", "3"]
+        resp = c.get("/export/bookings", query_string={
+            "format": "ndjson", "since": rows[0]["cursor"]})
+        assert len(resp.data.decode().splitlines()) == 2
+        assert c.get("/export/bookings?from=1999-01-01&to=1999-12-31").data \
+            .decode().splitlines() == ["cursor,club,competition,spots,time"]
+        assert c.get("/export/bookings?since=oops").status_code == 400
+
+
+def test_ready_once_warmed_up(tmp_path):
+    with patch.dict(app.config, TEMPLATE_CACHE_DIR=str(tmp_path / "jinja")), \
+         patch("server.warmed_up", server.threading.Event()), \
+         patch.object(app.jinja_env, "bytecode_cache"), \
+         patch.object(app.jinja_env, "cache", {}), \
+         app.test_client() as c:
+        resp = c.get("/ready")
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "1"
+
+        assert server.create_app() is app
+        assert c.get("/ready").status_code == 200
+        assert any((tmp_path / "jinja").iterdir())
+        assert (tmp_path / "jinja").stat().st_mode & 0o777 == 0o700
+        assert c.get("/clubs").status_code == 200
+
+
+def test_template_cache_folder_open_to_others_is_refused(tmp_path):
+    directory = tmp_path / "jinja"
+    directory.mkdir(mode=0o777)
+    directory.chmod(0o777)
+    with patch.dict(app.config, TEMPLATE_CACHE_DIR=str(directory)), \
+         patch("server.warmed_up", server.threading.Event()), \
+         patch.object(app.jinja_env, "bytecode_cache"), \
+         pytest.raises(RuntimeError):
+        server.create_app()
+
+
+def test_logins_are_rate_limited_per_email_and_client():
+    with patch.dict(app.config, LOGIN_RATE_LIMIT=[0.01, 2]), \
+         app.test_client() as c:
+        for _ in range(2):
+            resp = c.post("/login", data={"email": "john@simplylift.co"})
+            assert resp.status_code == 302
+        resp = c.post("/login", data={"email": "john@simplylift.co"})
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "100"
+        resp = c.post("/login", data={"email": "admin@irontemple.com"})
+        assert resp.status_code == 302
+        # Tries from elsewhere do not lock the club out
+        resp = c.post("/login", data={"email": "john@simplylift.co"},
+                      environ_base={"REMOTE_ADDR": "203.0.113.9"})
+        assert resp.status_code == 302
+
+
+def test_bookings_are_rate_limited_per_club_and_client():
+    clubs, competitions = booking_data()
+    clubs.append({"name": "Iron Temple",
+                  "email": "admin@irontemple.com", "points": "4"})
+    with use_data(clubs, competitions) as registry, \
+         patch.dict(app.config, BOOKING_RATE_LIMIT=[1.0, 1],
+                    CLIENT_RATE_LIMIT=[0.01, 4]), \
+         app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        form = {"competition": "Spring Festival", "spots": "1"}
+        assert c.post("/book", data=form).status_code == 200
+        resp = c.post("/book", data=form)
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "1"
+        assert registry.club_by_name("Simply Lift").points == 9
+        # Another club is not held back by the first one's limit, but
+        # this client address has now used up its own
+        assert c.post("/login", data={
+            "email": "admin@irontemple.com"}).status_code == 302
+        assert c.post("/book", data=form).status_code == 429
+        assert registry.club_by_name("Iron Temple").points == 4
+
+
+def test_anonymous_requests_do_not_reset_the_limit_of_a_club():
+    with use_data(*booking_data()), \
+         patch("server.rate_limiter", RateLimiter(maxsize=5)), \
+         patch.dict(app.config, BOOKING_RATE_LIMIT=[0.01, 1]), \
+         app.test_client() as c:
+        c.post("/login", data={"email": "john@simplylift.co"})
+        form = {"competition": "Spring Festival", "spots": "1"}
+        assert c.post("/book", data=form).status_code == 200
+        assert c.post("/book", data=form).status_code == 429
+        with app.test_client() as anonymous:
+            for _ in range(6):
+                anonymous.post("/book", data=form)
+        assert c.post("/book", data=form).status_code == 429
+
+
+def test_client_limit_behind_a_proxy_uses_the_forwarded_address():
+    with patch.dict(app.config, LOGIN_RATE_LIMIT=None,
+                    CLIENT_RATE_LIMIT=[0.01, 1]), \
+         patch.object(app, "wsgi_app", ProxyFix(app.wsgi_app, x_for=1)), \
+         app.test_client() as c:
+        for client in ("203.0.113.1", "203.0.113.2"):
+            headers = {"X-Forwarded-For": client}
+            resp = c.post("/login", data={"email": "john@simplylift.co"},
+                          headers=headers)
+            assert resp.status_code == 302
+        resp = c.post("/login", data={"email": "john@simplylift.co"},
+                      headers=headers)
+        assert resp.status_code == 429
@@ -0,0 +1,79 @@
+from unittest.mock import patch
+
+import server
+from benchmarks.generate import (
+    generate_clubs, generate_competitions, write_data
+)
+from benchmarks.replay import main as main_replay, replay
+from benchmarks.run import compare, main, run_size, serving
+from capture import TrafficCapture, read_capture
+from provider import Club, Competition
+
+
+def test_generated_data_is_valid():
+    clubs = generate_clubs(50)
+    competitions = generate_competitions(20)
+    assert len({club["email"] for club in clubs}) == 50
+    assert all(Competition.from_dict(c).date for c in competitions)
+    assert all(Club.from_dict(club).points >= 20 for club in clubs)
+
+
+def test_run_size_drives_every_route():
+    results = run_size(20, 10, requests=5)
+    assert set(results) == {"login", "summary", "book", "clubs"}
+    assert all(result["errors"] == 0 for result in results.values())
+    assert all(result["requests"] == 5 for result in results.values())
+
+
+def test_compare_flags_regressions():
+    baseline = {"10x5": {"book": {
+        "throughput": 100.0, "p50_ms": 1.0, "p99_ms": 2.0}}}
+    results = {"10x5": {"book": {
+        "throughput": 60.0, "p50_ms": 1.1, "p99_ms": 5.0}}}
+    regressions = compare(results, baseline, threshold=0.2)
+    assert len(regressions) == 2
+    assert compare(baseline, baseline, threshold=0.2) == []
+
+
+def test_main_compares_with_saved_baseline(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    args = ["--sizes", "10x5", "--requests", "3"]
+    assert main(args + ["--save-baseline", str(baseline)]) == 0
+    assert main(args + ["--baseline", str(baseline),
+                        "--threshold", "1000"]) == 0
+
+
+def test_capture_and_replay(tmp_path):
+    log = tmp_path / "capture.jsonl"
+    clubs = generate_clubs(3)
+    competitions = generate_competitions(4)
+    data = tmp_path / "data"
+    write_data(data, clubs, competitions)
+    email = clubs[0]["email"]
+    upcoming = competitions[-1]["name"]
+
+    capture = TrafficCapture(log)
+    with serving(clubs, competitions), \
+         patch("server.capture", capture), \
+         server.app.test_client() as client:
+        client.get("/clubs")
+        client.post("/login", data={"email": email})
+        client.get("/summary")
+        client.post("/book", data={"competition": upcoming, "spots": "1"})
+        client.post("/api/bookings", json={"bookings": [
+            {"competition": upcoming, "spots": 1}]})
+    capture.close()
+
+    entries = read_capture(log)
+    assert [entry["r"] for entry in entries] == [
+        "/clubs", "/login", "/summary", "/book", "/api/bookings"]
+    assert entries[0]["c"] is None
+    assert {entry["c"] for entry in entries[1:]} == {email}
+    assert entries[3]["f"] == {"competition": upcoming, "spots": "1"}
+    assert entries[4]["j"]["bookings"][0]["spots"] == 1
+
+    with serving(clubs, competitions):
+        by_route, _ = replay(entries, speedup=100, workers=2)
+    assert [status for _, status in by_route["/book"]] == [200]
+    assert main_replay([str(log), "--speedup", "100",
+                        "--data", str(data)]) == 0
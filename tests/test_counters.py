@@ -0,0 +1,239 @@
+import json
+import multiprocessing
+import os
+import threading
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+from counters import SharedCounters
+from journal import BookingJournal
+from provider import JsonStorage, Registry
+
+CLUBS = [{"name": "Alpha", "email": "a@club.com", "points": "10"},
+         {"name": "Beta", "email": "b@club.com", "points": "3"}]
+COMPETITIONS = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                 "spotsAvailable": "5"}]
+
+
+@pytest.fixture
+def counters(request):
+    counters = SharedCounters(
+        COMPETITIONS, CLUBS, version=request.node.name, prefix="gudlft-test")
+    yield counters
+    counters.unlink()
+    counters.close()
+
+
+def test_take_checks_and_decrements(counters):
+    assert counters.take("Alpha", [("Open", 4)])
+    assert counters.spots_available("Open") == 1
+    assert counters.points("Alpha") == 6
+    assert not counters.take("Beta", [("Open", 2)])
+    assert counters.points("Beta") == 3
+    counters.give_back("Alpha", [("Open", 4)])
+    assert counters.spots_available("Open") == 5
+
+
+def test_workers_share_counters(counters):
+    other = SharedCounters(
+        COMPETITIONS, CLUBS, version="other data", prefix="gudlft-other")
+    assert other.name != counters.name
+    other.unlink()
+    other.close()
+
+    attached = SharedCounters(
+        [dict(c, spotsAvailable="99") for c in COMPETITIONS], CLUBS,
+        version="test_workers_share_counters", prefix="gudlft-test")
+    assert attached.name == counters.name
+    # The segment was already initialised, so it keeps its values
+    assert attached.spots_available("Open") == 5
+    assert attached.take("Alpha", [("Open", 2)])
+    assert counters.spots_available("Open") == 3
+    attached.close()
+
+
+def _take(version, results):
+    counters = SharedCounters(
+        COMPETITIONS, CLUBS, version=version, prefix="gudlft-test")
+    results.put(counters.take("Alpha", [("Open", 1)]))
+    counters.close()
+
+
+def test_take_is_atomic_across_processes(counters):
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=_take,
+            args=("test_take_is_atomic_across_processes", results))
+        for _ in range(8)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sorted(results.get() for _ in workers).count(True) == 5
+    assert counters.spots_available("Open") == 0
+    assert counters.points("Alpha") == 5
+
+
+def test_registry_books_against_shared_counters():
+    first = Registry.from_records(
+        [dict(c) for c in CLUBS], [dict(c) for c in COMPETITIONS])
+    second = Registry.from_records(
+        [dict(c) for c in CLUBS], [dict(c) for c in COMPETITIONS])
+    first.shared_counters = second.shared_counters = True
+    first.counters_prefix = second.counters_prefix = "gudlft-test"
+    first.refresh()
+    second.refresh()
+    try:
+        assert first.book(first.club_by_name("Alpha"),
+                          first.competition_by_name("Open"), 4)
+        assert second.competition_by_name("Open").spots_available == 1
+        assert not second.book(second.club_by_name("Beta"),
+                               second.competition_by_name("Open"), 2)
+        assert second.club_by_name("Beta").points == 3
+    finally:
+        first.counters.unlink()
+        first.counters.close()
+        second.counters.close()
+
+
+def test_shared_bookings_move_clubs_on_the_leaderboard():
+    clubs = [dict(CLUBS[0]), dict(CLUBS[1], points="8")]
+    first = Registry.from_records(
+        [dict(c) for c in clubs], [dict(c) for c in COMPETITIONS])
+    second = Registry.from_records(
+        [dict(c) for c in clubs], [dict(c) for c in COMPETITIONS])
+    first.shared_counters = second.shared_counters = True
+    first.counters_prefix = second.counters_prefix = "gudlft-test"
+    first.refresh()
+    second.refresh()
+    try:
+        leaderboard = second._data.leaderboard
+        assert [club.name for club in second.leaderboard()] == [
+            "Alpha", "Beta"]
+        assert first.book(first.club_by_name("Alpha"),
+                          first.competition_by_name("Open"), 5)
+        assert [club.name for club in second.leaderboard()] == [
+            "Beta", "Alpha"]
+        assert [club.points for club in second.leaderboard()] == [8, 5]
+        assert second._data.leaderboard is leaderboard
+    finally:
+        first.counters.unlink()
+        first.counters.close()
+        second.counters.close()
+
+
+def write_data(tmp_path):
+    clubs_path = tmp_path / "clubs.json"
+    competitions_path = tmp_path / "competitions.json"
+    clubs_path.write_text(json.dumps({"clubs": CLUBS}))
+    competitions_path.write_text(json.dumps({"competitions": COMPETITIONS}))
+    return clubs_path, competitions_path
+
+
+def shared_registry(tmp_path):
+    storage = JsonStorage(*write_data(tmp_path),
+                          journal=BookingJournal(tmp_path / "bookings.jsonl"))
+    return Registry(storage, shared_counters=True,
+                    counters_prefix="gudlft-test")
+
+
+def test_reload_removes_the_counters_of_the_old_data(tmp_path):
+    clubs_path, competitions_path = write_data(tmp_path)
+    registry = Registry(JsonStorage(clubs_path, competitions_path),
+                        shared_counters=True, counters_prefix="gudlft-test")
+    registry.refresh()
+    old = registry.counters
+    try:
+        clubs_path.write_text(json.dumps({"clubs": CLUBS[:1]}))
+        os.utime(clubs_path, ns=(0, 0))
+        assert registry.club_by_name("Beta") is None
+        assert registry.counters is not old
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(old.name)
+    finally:
+        registry.counters.unlink()
+        registry.counters.close()
+
+
+def test_workers_sharing_counters_give_the_same_version():
+    first = Registry.from_records(
+        [dict(c) for c in CLUBS], [dict(c) for c in COMPETITIONS])
+    second = Registry.from_records(
+        [dict(c) for c in CLUBS], [dict(c) for c in COMPETITIONS])
+    first.shared_counters = second.shared_counters = True
+    first.counters_prefix = second.counters_prefix = "gudlft-test"
+    first.refresh()
+    second.refresh()
+    try:
+        version = first.version
+        assert second.version == version
+        assert first.book(first.club_by_name("Alpha"),
+                          first.competition_by_name("Open"), 1)
+        assert first.version != version
+        assert second.version == first.version
+    finally:
+        first.counters.unlink()
+        first.counters.close()
+        second.counters.close()
+
+
+def test_bookings_on_the_old_data_are_kept_after_a_reload(tmp_path):
+    first = shared_registry(tmp_path)
+    second = shared_registry(tmp_path)
+    club = second.club_by_name("Alpha")
+    competition = second.competition_by_name("Open")
+    try:
+        os.utime(tmp_path / "clubs.json", ns=(0, 0))
+        first.refresh()
+        # The second worker has not reloaded yet: its counters are
+        # retired, so it cannot book behind the back of the first
+        assert not second.book_many(club, [(competition, 4)])
+        assert second.book(second.club_by_name("Alpha"),
+                           second.competition_by_name("Open"), 4)
+        assert second.counters.name == first.counters.name
+        assert first.competition_by_name("Open").spots_available == 1
+        assert not first.book(first.club_by_name("Beta"),
+                              first.competition_by_name("Open"), 2)
+    finally:
+        first.counters.unlink()
+        first.counters.close()
+        second.counters.close()
+
+
+def test_new_counters_wait_for_bookings_being_committed(tmp_path):
+    first = shared_registry(tmp_path)
+    second = shared_registry(tmp_path)
+    journal = second.storage.journal
+    committing, release = threading.Event(), threading.Event()
+    append = journal.append
+
+    def slow_append(record):
+        committing.set()
+        release.wait(5)
+        append(record)
+
+    journal.append = slow_append
+    booking = threading.Thread(target=second.book, args=(
+        second.club_by_name("Alpha"),
+        second.competition_by_name("Open"), 4))
+    booking.start()
+    try:
+        assert committing.wait(5)
+        os.utime(tmp_path / "clubs.json", ns=(0, 0))
+        reload = threading.Thread(target=first.refresh)
+        reload.start()
+        reload.join(0.1)
+        assert reload.is_alive()
+        release.set()
+        booking.join(5)
+        reload.join(5)
+        assert first.competition_by_name("Open").spots_available == 1
+        assert second.competition_by_name("Open").spots_available == 1
+    finally:
+        release.set()
+        first.counters.unlink()
+        first.counters.close()
+        second.counters.close()
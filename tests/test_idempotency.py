@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from idempotency import IdempotencyCache, InProgress
+
+
+def test_result_is_replayed():
+    cache = IdempotencyCache()
+    calls = []
+
+    def book():
+        calls.append(1)
+        return "booked"
+
+    assert cache.run("key", book) == ("booked", False)
+    assert cache.run("key", book) == ("booked", True)
+    assert cache.run("other", book) == ("booked", False)
+    assert len(calls) == 2
+
+
+def test_results_not_kept_run_again():
+    cache = IdempotencyCache()
+    results = iter([409, 200])
+
+    def book():
+        return next(results)
+
+    keep = (lambda status: status != 409)
+    assert cache.run("key", book, keep) == (409, False)
+    assert cache.run("key", book, keep) == (200, False)
+    assert cache.run("key", book, keep) == (200, True)
+
+
+def test_failed_run_is_not_kept():
+    cache = IdempotencyCache()
+    with pytest.raises(ZeroDivisionError):
+        cache.run("key", lambda: 1 / 0)
+    assert cache.run("key", lambda: "booked") == ("booked", False)
+
+
+def test_duplicate_waits_for_the_first_run():
+    cache = IdempotencyCache()
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def slow_booking():
+        started.set()
+        release.wait()
+        return "booked"
+
+    first = threading.Thread(
+        target=lambda: results.append(cache.run("key", slow_booking)))
+    first.start()
+    started.wait()
+    second = threading.Thread(
+        target=lambda: results.append(cache.run("key", lambda: "again")))
+    second.start()
+    release.set()
+    first.join()
+    second.join()
+    assert sorted(results) == [("booked", False), ("booked", True)]
+
+
+def test_duplicate_gives_up_while_first_run_is_stuck():
+    cache = IdempotencyCache(wait=0.01)
+    started = threading.Event()
+    release = threading.Event()
+
+    def stuck_booking():
+        started.set()
+        release.wait()
+
+    first = threading.Thread(target=cache.run, args=("key", stuck_booking))
+    first.start()
+    started.wait()
+    with pytest.raises(InProgress):
+        cache.run("key", lambda: "again")
+    release.set()
+    first.join()
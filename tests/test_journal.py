@@ -0,0 +1,179 @@
+import threading
+
+import pytest
+
+import journal
+from admission import AdmissionControl
+from journal import BookingJournal
+from provider import Registry
+
+
+def test_append_and_replay(tmp_path):
+    log = BookingJournal(tmp_path / "bookings.jsonl")
+    log.append({"club": "Alpha", "competition": "Open", "spots": 2})
+    log.append({"club": "Beta", "competition": "Open", "spots": 1})
+    log.close()
+    records = list(BookingJournal(tmp_path / "bookings.jsonl").replay())
+    assert [r["club"] for r in records] == ["Alpha", "Beta"]
+
+
+def test_replay_skips_torn_last_line(tmp_path):
+    path = tmp_path / "bookings.jsonl"
+    path.write_text('{"club": "Alpha", "competition": "Open", "spots": 2}\n'
+                    '{"club": "Be')
+    assert len(list(BookingJournal(path).replay())) == 1
+
+
+def test_replay_missing_file(tmp_path):
+    assert list(BookingJournal(tmp_path / "missing.jsonl").replay()) == []
+
+
+def test_concurrent_appends_share_fsyncs(tmp_path, monkeypatch):
+    fsyncs = []
+    real_fsync = journal.os.fsync
+    monkeypatch.setattr(journal.os, "fsync",
+                        lambda fd: fsyncs.append(fd) or real_fsync(fd))
+    log = BookingJournal(tmp_path / "bookings.jsonl", commit_delay=0.01)
+    threads = [
+        threading.Thread(target=log.append, args=({"spots": n},))
+        for n in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(list(log.replay())) == 20
+    assert len(fsyncs) < 20
+
+
+def test_failed_write_leaves_no_partial_line(tmp_path, monkeypatch):
+    path = tmp_path / "bookings.jsonl"
+    log = BookingJournal(path)
+    log.append({"club": "Alpha", "spots": 1})
+    real_write = journal.os.write
+
+    def half_write(fd, data):
+        real_write(fd, bytes(data[:len(data) // 2]))
+        raise OSError("disk full")
+
+    monkeypatch.setattr(journal.os, "write", half_write)
+    with pytest.raises(OSError):
+        log.append({"club": "Beta", "spots": 2})
+    monkeypatch.setattr(journal.os, "write", real_write)
+    log.append({"club": "Gamma", "spots": 3})
+    assert [record["club"] for record in log.replay()] == ["Alpha", "Gamma"]
+
+
+def test_every_writer_of_a_failed_flush_gets_the_error(
+        tmp_path, monkeypatch):
+    fsyncs = []
+
+    def failing_fsync(fd):
+        fsyncs.append(fd)
+        if len(fsyncs) == 1:
+            raise OSError("I/O error")
+
+    monkeypatch.setattr(journal.os, "fsync", failing_fsync)
+    log = BookingJournal(tmp_path / "bookings.jsonl", commit_delay=0.2)
+    outcomes = []
+
+    def append(n):
+        try:
+            log.append({"spots": n})
+            outcomes.append("written")
+        except OSError:
+            outcomes.append("failed")
+
+    threads = [threading.Thread(target=append, args=(n,)) for n in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    append(5)
+    assert outcomes == ["failed"] * 5 + ["written"]
+    assert [record["spots"] for record in log.replay()] == [5]
+
+
+def test_bookings_queued_for_one_competition_share_fsyncs(
+        tmp_path, monkeypatch):
+    fsyncs = []
+    real_fsync = journal.os.fsync
+    monkeypatch.setattr(journal.os, "fsync",
+                        lambda fd: fsyncs.append(fd) or real_fsync(fd))
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "50"}]
+    competitions = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                     "spotsAvailable": "50"}]
+    registry = Registry.from_records(clubs, competitions, BookingJournal(
+        tmp_path / "bookings.jsonl", commit_delay=0.01))
+    admission = AdmissionControl()
+    club = registry.club_by_name("Alpha")
+    competition = registry.competition_by_name("Open")
+    results = []
+
+    def book():
+        commit = admission.submit(
+            "Open", lambda: registry.reserve(club, [(competition, 1)]))
+        results.append(commit())
+
+    threads = [threading.Thread(target=book) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [True] * 20
+    assert registry.competition_by_name("Open").spots_available == 30
+    assert len(fsyncs) < 20
+
+
+def test_registry_replays_journal_over_records(tmp_path):
+    path = tmp_path / "bookings.jsonl"
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "10"}]
+    competitions = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                     "spotsAvailable": "8"}]
+    registry = Registry.from_records(
+        clubs, competitions, journal=BookingJournal(path))
+    club = registry.club_by_name("Alpha")
+    competition = registry.competition_by_name("Open")
+    assert registry.book(club, competition, 3)
+    assert not registry.book(club, competition, 8)
+
+    registry = Registry.from_records(
+        clubs, competitions, journal=BookingJournal(path))
+    assert registry.club_by_name("Alpha").points == 7
+    assert registry.competition_by_name("Open").spots_available == 5
+
+
+def test_batch_bookings_are_one_journal_record(tmp_path):
+    path = tmp_path / "bookings.jsonl"
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "10"}]
+    competitions = [
+        {"name": "Open", "date": "2099-01-01 10:00:00",
+         "spotsAvailable": "8"},
+        {"name": "Cup", "date": "2099-02-01 10:00:00",
+         "spotsAvailable": "8"},
+    ]
+    registry = Registry.from_records(
+        clubs, competitions, journal=BookingJournal(path))
+    assert registry.book_many(registry.club_by_name("Alpha"), [
+        (registry.competition_by_name("Open"), 2),
+        (registry.competition_by_name("Cup"), 3),
+    ])
+    assert len(list(BookingJournal(path).replay())) == 1
+
+    registry = Registry.from_records(
+        clubs, competitions, journal=BookingJournal(path))
+    assert registry.club_by_name("Alpha").points == 5
+    assert registry.competition_by_name("Cup").spots_available == 5
+
+
+def test_entries_resume_from_an_offset(tmp_path):
+    path = tmp_path / "bookings.jsonl"
+    path.write_text('{"club": "Alpha", "spots": 2}\n'
+                    'not json\n'
+                    '{"club": "Beta", "spots": 1}\n'
+                    '{"club": "Ga')
+    log = BookingJournal(path)
+    entries = list(log.entries())
+    assert [(record["club"]) for _, record in entries] == ["Alpha", "Beta"]
+    offset = entries[1][0]
+    assert [record["club"] for _, record in log.entries(offset)] == ["Beta"]
@@ -0,0 +1,51 @@
+import random
+
+from leaderboard import Leaderboard
+from provider import Club
+
+
+def make_clubs(*points):
+    return [Club(f"Club {n}", f"club{n}@club.com", value)
+            for n, value in enumerate(points)]
+
+
+def names(clubs):
+    return [club.name for club in clubs]
+
+
+def test_clubs_ranked_by_points_then_load_order():
+    leaderboard = Leaderboard(make_clubs(5, 12, 5, 30))
+    assert names(leaderboard.page()) == [
+        "Club 3", "Club 1", "Club 0", "Club 2"]
+    assert names(leaderboard.page(1, 2)) == ["Club 1", "Club 0"]
+    assert leaderboard.page(10, 5) == []
+    assert len(leaderboard) == 4
+
+
+def test_update_moves_a_club():
+    clubs = make_clubs(5, 12, 5, 30)
+    leaderboard = Leaderboard(clubs)
+    clubs[3].points = 5
+    leaderboard.update(clubs[3])
+    assert names(leaderboard.page()) == [
+        "Club 1", "Club 0", "Club 2", "Club 3"]
+    clubs[2].points = 20
+    leaderboard.update(clubs[2])
+    assert names(leaderboard.page()) == [
+        "Club 2", "Club 1", "Club 0", "Club 3"]
+    # Unknown clubs are ignored
+    leaderboard.update(Club("Other", "other@club.com", 99))
+    assert len(leaderboard) == 4
+
+
+def test_updates_match_a_full_sort():
+    rng = random.Random(1)
+    clubs = make_clubs(*(rng.randrange(50) for _ in range(200)))
+    leaderboard = Leaderboard(clubs)
+    for _ in range(500):
+        club = rng.choice(clubs)
+        club.points = rng.randrange(50)
+        leaderboard.update(club)
+    expected = sorted(
+        clubs, key=lambda club: (-club.points, clubs.index(club)))
+    assert leaderboard.page() == expected
@@ -0,0 +1,29 @@
+from metrics import Histogram, Metrics
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert list(histogram.cumulative()) == [
+        (0.1, 2), (1.0, 3), (float("inf"), 4)]
+    assert histogram.count == 4
+
+
+def test_render_prometheus_text():
+    metrics = Metrics()
+    metrics.histogram("latency_seconds", "Latency", buckets=(0.1,))
+    metrics.counter("rejections_total", "Rejections")
+    metrics.observe("latency_seconds", 0.05, endpoint="login")
+    metrics.increment("rejections_total", reason='say "no"')
+    assert metrics.render().splitlines() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{endpoint="login",le="0.1"} 1',
+        'latency_seconds_bucket{endpoint="login",le="+Inf"} 1',
+        'latency_seconds_sum{endpoint="login"} 0.05',
+        'latency_seconds_count{endpoint="login"} 1',
+        "# HELP rejections_total Rejections",
+        "# TYPE rejections_total counter",
+        'rejections_total{reason="say \\"no\\""} 1',
+    ]
@@ -0,0 +1,453 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+from journal import BookingJournal
+from provider import (
+    Club, Competition, JsonStorage, Registry, SqliteStorage, get_clubs,
+    get_competitions
+)
+
+
+def write_data(tmp_path, clubs, competitions):
+    """Write clubs and competitions JSON files, return their paths"""
+    clubs_path = tmp_path / "clubs.json"
+    competitions_path = tmp_path / "competitions.json"
+    clubs_path.write_text(json.dumps({"clubs": clubs}))
+    competitions_path.write_text(json.dumps({"competitions": competitions}))
+    return clubs_path, competitions_path
+
+
+def test_load_from_json_files():
+    """Clubs and competitions can be loaded from the JSON files"""
+    assert {"name", "email", "points"} <= set(get_clubs()[0])
+    assert {"name", "date", "spotsAvailable"} <= set(get_competitions()[0])
+
+
+def test_registry_lookups(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "4"}]
+    competitions = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                     "spotsAvailable": "3"}]
+    registry = Registry(
+        JsonStorage(*write_data(tmp_path, clubs, competitions)))
+    assert registry.club_by_email("a@club.com")["name"] == "Alpha"
+    assert registry.club_by_name("Alpha")["email"] == "a@club.com"
+    assert registry.competition_by_name("Open")["spotsAvailable"] == 3
+    assert registry.club_by_email("missing@club.com") is None
+    assert registry.competition_by_name("Missing") is None
+
+
+def test_registry_reloads_only_when_file_changes(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "4"}]
+    clubs_path, competitions_path = write_data(tmp_path, clubs, [])
+    registry = Registry(JsonStorage(clubs_path, competitions_path))
+    loaded = registry.clubs
+    assert registry.clubs is loaded
+
+    clubs.append({"name": "Beta", "email": "b@club.com", "points": "9"})
+    clubs_path.write_text(json.dumps({"clubs": clubs}))
+    os.utime(clubs_path, ns=(0, 0))
+    assert registry.clubs is not loaded
+    assert registry.club_by_email("b@club.com")["name"] == "Beta"
+
+
+def test_registry_from_records():
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "4"},
+             {"name": "Alpha", "email": "dup@club.com", "points": "1"}]
+    registry = Registry.from_records(clubs, [])
+    assert registry.club_by_name("Alpha").email == "a@club.com"
+    assert [club.to_dict() for club in registry.clubs] == [
+        {"name": "Alpha", "email": "a@club.com", "points": 4},
+        {"name": "Alpha", "email": "dup@club.com", "points": 1},
+    ]
+
+
+def test_records_are_parsed_once():
+    club = Club.from_dict(
+        {"name": "Alpha", "email": "a@club.com", "points": "4"})
+    competition = Competition.from_dict(
+        {"name": "Open", "date": "2099-01-01 10:00:00",
+         "spotsAvailable": "3"})
+    assert club.points == club["points"] == 4
+    assert competition.date == datetime(2099, 1, 1, 10)
+    assert competition["date"] == "2099-01-01 10:00:00"
+    assert competition["spotsAvailable"] == 3
+    assert competition.get("missing") is None
+    assert not hasattr(club, "__dict__")
+
+
+def test_competition_with_invalid_date():
+    competition = Competition.from_dict(
+        {"name": "Open", "date": "next week", "spotsAvailable": "3"})
+    assert competition.date is None
+    assert competition["date"] == "next week"
+
+
+def sqlite_registry(tmp_path, clubs, competitions):
+    """Registry over a SQLite database seeded with the records"""
+    seed = Registry.from_records(clubs, competitions).storage
+    return Registry(SqliteStorage(tmp_path / "gudlft.db", seed=seed))
+
+
+def test_sqlite_storage_loads_seed(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "4"}]
+    competitions = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                     "spotsAvailable": "3"}]
+    registry = sqlite_registry(tmp_path, clubs, competitions)
+    assert [club.to_dict() for club in registry.clubs] == [
+        {"name": "Alpha", "email": "a@club.com", "points": 4}]
+    assert registry.competition_by_name("Open").date_text == (
+        "2099-01-01 10:00:00")
+
+
+def test_sqlite_storage_keeps_undated_competitions(tmp_path):
+    competitions = [{"name": "Undated", "spotsAvailable": "3"}]
+    registry = sqlite_registry(tmp_path, [], competitions)
+    assert registry.competition_by_name("Undated").date is None
+
+
+def test_sqlite_seed_with_duplicate_names_fails(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "4"},
+             {"name": "Alpha", "email": "dup@club.com", "points": "1"}]
+    with pytest.raises(sqlite3.IntegrityError):
+        sqlite_registry(tmp_path, clubs, [])
+
+
+def test_sqlite_booking_is_shared_between_workers(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "10"},
+             {"name": "Beta", "email": "b@club.com", "points": "10"}]
+    competitions = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                     "spotsAvailable": "5"}]
+    first = sqlite_registry(tmp_path, clubs, competitions)
+    second = sqlite_registry(tmp_path, clubs, competitions)
+    # Both workers have loaded the competition with 5 spots available
+    stale = second.competition_by_name("Open")
+
+    assert first.book(first.club_by_name("Alpha"),
+                      first.competition_by_name("Open"), 4)
+    assert not second.storage.book("Beta", [("Open", 4)])
+    assert second.competition_by_name("Open") is not stale
+    assert second.competition_by_name("Open").spots_available == 1
+    assert second.club_by_name("Alpha").points == 6
+    assert second.club_by_name("Beta").points == 10
+
+
+def test_sqlite_booking_checks_points(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "2"}]
+    competitions = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                     "spotsAvailable": "5"}]
+    registry = sqlite_registry(tmp_path, clubs, competitions)
+    assert not registry.storage.book("Alpha", [("Open", 3)])
+    assert registry.storage.load() == (
+        [Club.from_dict(club) for club in clubs],
+        [Competition.from_dict(c) for c in competitions])
+
+
+def test_upcoming_competitions_sorted_by_date():
+    competitions = [
+        {"name": "Late", "date": "2099-06-01 10:00:00",
+         "spotsAvailable": "1"},
+        {"name": "Past", "date": "2020-01-01 10:00:00",
+         "spotsAvailable": "1"},
+        {"name": "Soon", "date": "2099-01-01 10:00:00",
+         "spotsAvailable": "1"},
+        {"name": "Broken", "date": "soon", "spotsAvailable": "1"},
+    ]
+    registry = Registry.from_records([], competitions)
+    now = datetime(2050, 1, 1)
+    assert [c.name for c in registry.upcoming(now=now)] == ["Soon", "Late"]
+    assert [c.name for c in registry.upcoming(1, 5, now=now)] == ["Late"]
+    assert registry.count_upcoming(now=now) == 2
+    assert registry.count_upcoming(now=datetime(2100, 1, 1)) == 0
+
+
+def test_sqlite_batch_booking_is_all_or_nothing(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "10"}]
+    competitions = [
+        {"name": "Open", "date": "2099-01-01 10:00:00",
+         "spotsAvailable": "5"},
+        {"name": "Cup", "date": "2099-02-01 10:00:00",
+         "spotsAvailable": "1"},
+    ]
+    registry = sqlite_registry(tmp_path, clubs, competitions)
+    assert not registry.storage.book("Alpha", [("Open", 2), ("Cup", 2)])
+    assert registry.storage.load()[1][0].spots_available == 5
+    assert registry.storage.book("Alpha", [("Open", 2), ("Cup", 1)])
+    assert registry.storage.load()[0][0].points == 7
+
+
+def snapshot_data():
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "4"},
+             {"name": "Bêta", "email": "b@club.com", "points": "9"}]
+    competitions = [
+        {"name": "Open", "date": "2099-01-01 10:00:00",
+         "spotsAvailable": "3"},
+        {"name": "Someday", "date": "next week", "spotsAvailable": "5"},
+        {"name": "Undated", "spotsAvailable": "1"},
+    ]
+    return clubs, competitions
+
+
+def test_snapshot_loads_the_same_records(tmp_path):
+    paths = write_data(tmp_path, *snapshot_data())
+    snapshot = tmp_path / "snapshot.bin"
+    parsed = JsonStorage(*paths).load()
+    assert JsonStorage(*paths, snapshot=snapshot).load() == parsed
+    assert snapshot.exists()
+    # The second load maps the snapshot instead of parsing the JSON
+    with patch("provider.JsonStorage._parse") as parse:
+        assert JsonStorage(*paths, snapshot=snapshot).load() == parsed
+    parse.assert_not_called()
+
+
+def test_snapshot_rebuilt_when_the_json_changes(tmp_path):
+    clubs, competitions = snapshot_data()
+    clubs_path, competitions_path = write_data(tmp_path, clubs, competitions)
+    snapshot = tmp_path / "snapshot.bin"
+    storage = JsonStorage(clubs_path, competitions_path, snapshot=snapshot)
+    storage.load()
+
+    clubs[0]["points"] = "7"
+    clubs_path.write_text(json.dumps({"clubs": clubs}))
+    loaded_clubs, _ = storage.load()
+    assert loaded_clubs[0].points == 7
+    with patch("provider.JsonStorage._parse") as parse:
+        assert storage.load()[0][0].points == 7
+    parse.assert_not_called()
+
+
+def test_corrupt_snapshot_is_ignored(tmp_path):
+    paths = write_data(tmp_path, *snapshot_data())
+    snapshot = tmp_path / "snapshot.bin"
+    expected = JsonStorage(*paths, snapshot=snapshot).load()
+    data = bytearray(snapshot.read_bytes())
+    data[-1] ^= 0xFF
+    snapshot.write_bytes(data)
+    assert JsonStorage(*paths, snapshot=snapshot).load() == expected
+    snapshot.write_bytes(b"")
+    assert JsonStorage(*paths, snapshot=snapshot).load() == expected
+
+
+def test_records_the_snapshot_cannot_hold_load_from_the_json(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com",
+              "points": "99999999999999999999"}]
+    paths = write_data(tmp_path, clubs, [])
+    snapshot = tmp_path / "snapshot.bin"
+    loaded, _ = JsonStorage(*paths, snapshot=snapshot).load()
+    assert loaded[0].points == 99999999999999999999
+    assert not snapshot.exists()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_watcher_swaps_in_new_data(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "4"}]
+    clubs_path, competitions_path = write_data(tmp_path, clubs, [])
+    storage = JsonStorage(clubs_path, competitions_path)
+    registry = Registry(storage, watch_interval=0.01)
+    loaded = registry.clubs
+    assert [club.name for club in loaded] == ["Alpha"]
+
+    # Replaced by rename, as editors do: new inode, same size
+    clubs[0]["name"] = "Gamma"
+    replacement = tmp_path / "clubs.new"
+    replacement.write_text(json.dumps({"clubs": clubs}))
+    os.replace(replacement, clubs_path)
+    wait_for(lambda: registry.club_by_name("Gamma") is not None)
+    assert registry.club_by_name("Alpha") is None
+    # Requests still holding the old records are unaffected
+    assert [club.name for club in loaded] == ["Alpha"]
+
+
+def test_reload_waits_for_bookings_being_committed(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "10"}]
+    competitions = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                     "spotsAvailable": "8"}]
+    clubs_path, competitions_path = write_data(tmp_path, clubs, competitions)
+    journal = BookingJournal(tmp_path / "bookings.jsonl")
+    registry = Registry(JsonStorage(clubs_path, competitions_path, journal))
+    committing, release = threading.Event(), threading.Event()
+    append = journal.append
+
+    def slow_append(record):
+        committing.set()
+        release.wait(5)
+        append(record)
+
+    journal.append = slow_append
+    booking = threading.Thread(target=registry.book, args=(
+        registry.club_by_name("Alpha"),
+        registry.competition_by_name("Open"), 3))
+    booking.start()
+    assert committing.wait(5)
+    clubs[0]["points"] = "11"
+    clubs_path.write_text(json.dumps({"clubs": clubs}))
+    os.utime(clubs_path, ns=(0, 0))
+    reload = threading.Thread(target=registry.refresh)
+    reload.start()
+    reload.join(0.1)
+    assert reload.is_alive()
+    release.set()
+    booking.join(5)
+    reload.join(5)
+    assert registry.club_by_name("Alpha").points == 8
+    assert registry.competition_by_name("Open").spots_available == 5
+
+
+def test_booking_records_replaced_by_a_reload(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "20"}]
+    competitions = [{"name": "Open", "date": "2099-01-01 10:00:00",
+                     "spotsAvailable": "5"}]
+    clubs_path, competitions_path = write_data(tmp_path, clubs, competitions)
+    journal = BookingJournal(tmp_path / "bookings.jsonl")
+    registry = Registry(JsonStorage(clubs_path, competitions_path, journal))
+    club = registry.club_by_name("Alpha")
+    competition = registry.competition_by_name("Open")
+
+    os.utime(clubs_path, ns=(0, 0))
+    assert registry.club_by_name("Alpha") is not club
+    assert registry.book(club, competition, 4)
+    assert registry.club_by_name("Alpha").points == 16
+    assert registry.competition_by_name("Open").spots_available == 1
+    assert not registry.book(registry.club_by_name("Alpha"),
+                             registry.competition_by_name("Open"), 5)
+
+
+def test_watcher_keeps_data_when_the_new_file_is_invalid(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "4"}]
+    clubs_path, competitions_path = write_data(tmp_path, clubs, [])
+    registry = Registry(
+        JsonStorage(clubs_path, competitions_path), watch_interval=0.01)
+    assert registry.club_by_name("Alpha") is not None
+    loads = []
+    registry.on_load = loads.append
+
+    clubs_path.write_text('{"clubs": [{"name": "Beta", "points": "x"}]}')
+    wait_for(lambda: registry._failed_signature is not None)
+    assert registry.club_by_name("Alpha") is not None
+    assert loads == []
+
+    clubs.append({"name": "Beta", "email": "b@club.com", "points": "9"})
+    clubs_path.write_text(json.dumps({"clubs": clubs}))
+    wait_for(lambda: registry.club_by_name("Beta") is not None)
+
+
+def search_registry():
+    competitions = [
+        {"name": "Spring Festival", "date": "2099-03-27 10:00:00",
+         "spotsAvailable": "25"},
+        {"name": "Fête du Printemps", "date": "2099-04-02 10:00:00",
+         "spotsAvailable": "8"},
+        {"name": "Summer  Spring Cup", "date": "2099-01-15 10:00:00",
+         "spotsAvailable": "4"},
+        {"name": "Spring Someday", "date": "soon", "spotsAvailable": "1"},
+        {"name": "Fall Classic", "date": "2099-10-22 13:30:00",
+         "spotsAvailable": "13"},
+    ]
+    return Registry.from_records([], competitions)
+
+
+def test_search_competitions_by_word_prefix():
+    registry = search_registry()
+
+    def search(*args, **kwargs):
+        return [competition.name for competition
+                in registry.search_competitions(*args, **kwargs)]
+
+    assert search("spr") == [
+        "Summer  Spring Cup", "Spring Festival", "Spring Someday"]
+    assert search("SPRING fest") == ["Spring Festival"]
+    assert search("fete") == ["Fête du Printemps"]
+    assert search("spr", limit=1) == ["Summer  Spring Cup"]
+    assert search("classic fall") == ["Fall Classic"]
+    assert search("pring") == []
+    assert search("spr", start=datetime(2099, 3, 1)) == ["Spring Festival"]
+    assert search("", start=datetime(2099, 3, 1),
+                  end=datetime(2099, 5, 1)) == [
+        "Spring Festival", "Fête du Printemps"]
+
+
+def test_search_lists_a_record_once_when_several_words_match():
+    competitions = [
+        {"name": "Spring Springfield Cup", "date": "2099-03-27 10:00:00",
+         "spotsAvailable": "25"},
+        {"name": "Fall Classic", "date": "2099-10-22 13:30:00",
+         "spotsAvailable": "13"},
+    ]
+    registry = Registry.from_records([], competitions)
+    assert [competition.name for competition
+            in registry.search_competitions("spr")] == [
+        "Spring Springfield Cup"]
+
+
+def test_search_common_words_walks_in_order():
+    competitions = [
+        {"name": f"Open {n:04}", "date": f"2099-01-01 {n % 24:02}:00:00",
+         "spotsAvailable": "5"}
+        for n in range(2000)
+    ]
+    registry = Registry.from_records([], competitions)
+    expected = [
+        competition.name for competition in sorted(
+            registry.competitions, key=lambda competition: competition.date)
+        if competition.name.startswith("Open 1")]
+    # Collecting the matches of the rarest word, then walking by date
+    for limit in (500, 7):
+        found = registry.search_competitions("open 1", limit=limit)
+        assert [competition.name for competition in found] == (
+            expected[:limit])
+
+
+def test_find_competition_ignores_case_and_accents():
+    registry = search_registry()
+    assert registry.find_competition("fete du  printemps").spots_available == 8
+    assert registry.find_competition("Fall Classic").name == "Fall Classic"
+    assert registry.find_competition("Winter") is None
+
+
+def test_search_clubs():
+    clubs = [{"name": "Iron Temple", "email": "a@club.com", "points": "4"},
+             {"name": "Simply Lift", "email": "b@club.com", "points": "9"},
+             {"name": "She Lifts", "email": "c@club.com", "points": "1"}]
+    registry = Registry.from_records(clubs, [])
+    assert [club.name for club in registry.search_clubs("lift")] == [
+        "Simply Lift", "She Lifts"]
+    assert registry.search_clubs("") == []
+
+
+def test_bookings_resume_after_a_cursor(tmp_path):
+    clubs = [{"name": "Alpha", "email": "a@club.com", "points": "10"}]
+    competitions = [
+        {"name": "Open", "date": "2099-01-01 10:00:00", "spotsAvailable": "5"},
+        {"name": "Cup", "date": "2099-02-01 10:00:00", "spotsAvailable": "5"},
+    ]
+    journal = BookingJournal(tmp_path / "bookings.jsonl")
+    registries = [
+        Registry.from_records(clubs, competitions, journal),
+        sqlite_registry(tmp_path, clubs, competitions),
+    ]
+    for registry in registries:
+        club = registry.club_by_name("Alpha")
+        registry.book(club, registry.competition_by_name("Open"), 1)
+        registry.book_many(club, [
+            (registry.competition_by_name("Open"), 2),
+            (registry.competition_by_name("Cup"), 3)])
+        rows = list(registry.bookings())
+        assert [(row["competition"], row["spots"]) for _, row in rows] == [
+            ("Open", 1), ("Open", 2), ("Cup", 3)]
+        assert {row["club"] for _, row in rows} == {"Alpha"}
+        for index, (cursor, _) in enumerate(rows):
+            assert list(registry.bookings(cursor)) == rows[index + 1:]
+        with pytest.raises(ValueError):
+            registry.bookings("not a cursor")
@@ -0,0 +1,53 @@
+from ratelimit import RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_refill():
+    clock = Clock()
+    limiter = RateLimiter(clock=clock)
+    assert [limiter.acquire("club", 0.5, 3) for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("club", 0.5, 3) == 2.0
+    clock.now = 1.0
+    assert limiter.acquire("club", 0.5, 3) == 1.0
+    clock.now = 2.0
+    assert limiter.acquire("club", 0.5, 3) == 0
+    # Refills up to the burst, never beyond
+    clock.now = 100.0
+    assert [limiter.acquire("club", 0.5, 3) for _ in range(4)] == [
+        0, 0, 0, 2.0]
+
+
+def test_keys_have_their_own_buckets():
+    limiter = RateLimiter(clock=Clock())
+    assert limiter.acquire("noisy", 1.0, 1) == 0
+    assert limiter.acquire("noisy", 1.0, 1) > 0
+    assert limiter.acquire("quiet", 1.0, 1) == 0
+
+
+def test_least_recently_used_buckets_are_evicted_once_refilled():
+    clock = Clock()
+    limiter = RateLimiter(maxsize=2, clock=clock)
+    limiter.acquire("a", 1.0, 1)
+    limiter.acquire("b", 1.0, 1)
+    clock.now = 1.0
+    limiter.acquire("a", 1.0, 1)
+    limiter.acquire("c", 1.0, 1)
+    assert len(limiter) == 2
+    # "b" had refilled: it was dropped and starts over with a full bucket
+    assert limiter.acquire("b", 1.0, 1) == 0
+    assert limiter.acquire("c", 1.0, 1) > 0
+
+
+def test_new_keys_do_not_evict_buckets_still_refilling():
+    limiter = RateLimiter(maxsize=1, clock=Clock())
+    limiter.acquire("club", 1.0, 1)
+    for n in range(5):
+        limiter.acquire(f"client {n}", 1.0, 1)
+    assert limiter.acquire("club", 1.0, 1) > 0
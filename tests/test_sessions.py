@@ -0,0 +1,66 @@
+from cache import LRUCache
+from sessions import SessionStore, SqliteSessionStore
+
+
+class Clock:
+    """Manually advanced clock for the cache"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_expires_entries():
+    clock = Clock()
+    cache = LRUCache(ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+
+
+def test_session_store_shared_between_workers(tmp_path):
+    path = tmp_path / "sessions.db"
+    first = SessionStore(shared=SqliteSessionStore(path, ttl=60))
+    second = SessionStore(shared=SqliteSessionStore(path, ttl=60))
+    first.set("sid", {"email": "a@club.com", "_flashes": [("message", "Hi")]})
+    assert second.get("sid") == {
+        "email": "a@club.com", "_flashes": [("message", "Hi")]}
+    first.delete("sid")
+    assert SessionStore(shared=SqliteSessionStore(path, ttl=60)).get(
+        "sid") is None
+
+
+def test_session_store_expires_sessions(tmp_path):
+    store = SqliteSessionStore(tmp_path / "sessions.db", ttl=-1)
+    store.set("sid", {"email": "a@club.com"})
+    assert store.get("sid") is None
+
+
+def test_expired_sessions_are_purged_once_per_interval(tmp_path):
+    path = tmp_path / "sessions.db"
+    store = SqliteSessionStore(path, ttl=-1, purge_interval=3600)
+
+    def rows():
+        return store._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    store.set("first", {"email": "a@club.com"})
+    store.set("second", {"email": "b@club.com"})
+    assert rows() == 2
+    store.ttl, store.purge_interval = 60, 0
+    store.set("third", {"email": "c@club.com"})
+    assert rows() == 1
@@ -0,0 +1,93 @@
+import threading
+
+from provider import Registry
+from waitlist import Waitlist
+
+
+def registry_with(spots, points=("10", "10")):
+    clubs = [
+        {"name": "Simply Lift", "email": "john@simplylift.co",
+         "points": points[0]},
+        {"name": "Iron Temple", "email": "admin@irontemple.com",
+         "points": points[1]},
+    ]
+    competitions = [{"name": "Summer Slam", "date": "2099-07-01 10:00:00",
+                     "spotsAvailable": str(spots)}]
+    return Registry.from_records(clubs, competitions)
+
+
+def allow(club, competition, spots):
+    if spots > club.points:
+        return "not_enough_points", "Not enough points.", 403
+    return None
+
+
+def test_join_returns_position_and_keeps_place():
+    waitlist = Waitlist()
+    assert waitlist.join("Summer Slam", "john@simplylift.co", 2) == 1
+    assert waitlist.join("Summer Slam", "admin@irontemple.com", 1) == 2
+    assert waitlist.join("Summer Slam", "john@simplylift.co", 3) == 1
+    assert waitlist.position("Summer Slam", "admin@irontemple.com") == 2
+    assert waitlist.position("Summer Slam", "kate@shelifts.co.uk") is None
+    assert waitlist.position("Fall Classic", "john@simplylift.co") is None
+
+
+def test_promote_books_in_order():
+    registry = registry_with(spots=3)
+    waitlist = Waitlist()
+    waitlist.join("Summer Slam", "john@simplylift.co", 2)
+    waitlist.join("Summer Slam", "admin@irontemple.com", 1)
+    assert waitlist.promote(registry, allow) == 2
+    assert registry.competition_by_name("Summer Slam").spots_available == 0
+    assert registry.club_by_name("Simply Lift").points == 8
+    assert waitlist.messages("john@simplylift.co") == [
+        "Great-you got 2 spots in Summer Slam from the waitlist!"]
+    assert waitlist.messages("john@simplylift.co") == []
+    assert waitlist.position("Summer Slam", "admin@irontemple.com") is None
+
+
+def test_head_of_queue_blocks_smaller_requests():
+    registry = registry_with(spots=1)
+    waitlist = Waitlist()
+    waitlist.join("Summer Slam", "john@simplylift.co", 2)
+    waitlist.join("Summer Slam", "admin@irontemple.com", 1)
+    assert waitlist.promote(registry, allow) == 0
+    assert waitlist.position("Summer Slam", "admin@irontemple.com") == 2
+    assert registry.competition_by_name("Summer Slam").spots_available == 1
+
+
+def test_club_that_cannot_book_leaves_the_queue():
+    registry = registry_with(spots=2, points=("1", "10"))
+    waitlist = Waitlist()
+    waitlist.join("Summer Slam", "john@simplylift.co", 2)
+    waitlist.join("Summer Slam", "admin@irontemple.com", 2)
+    assert waitlist.promote(registry, allow) == 1
+    assert waitlist.position("Summer Slam", "john@simplylift.co") is None
+    assert waitlist.messages("john@simplylift.co") == []
+    assert registry.club_by_name("Iron Temple").points == 8
+
+
+def test_club_beaten_to_the_spots_keeps_its_place():
+    registry = registry_with(spots=2)
+    waitlist = Waitlist()
+    waitlist.join("Summer Slam", "john@simplylift.co", 2)
+    waitlist.join("Summer Slam", "admin@irontemple.com", 1)
+    registry.book = lambda club, competition, spots: False
+    assert waitlist.promote(registry, allow) == 0
+    assert waitlist.position("Summer Slam", "john@simplylift.co") == 1
+    assert waitlist.position("Summer Slam", "admin@irontemple.com") == 2
+
+
+def test_notify_wakes_the_promotion_thread():
+    registry = registry_with(spots=1)
+    waitlist = Waitlist()
+    waitlist.join("Summer Slam", "john@simplylift.co", 1)
+    promoted = threading.Event()
+
+    def check(club, competition, spots):
+        promoted.set()
+        return None
+
+    waitlist.start(lambda: registry, check, interval=60)
+    waitlist.notify()
+    assert promoted.wait(5)
@@ -0,0 +1,126 @@
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Waitlist:
+    """Clubs waiting for spots in full competitions, first come first
+    served.
+
+    Rather than retrying /book, a club joins the waitlist once. A
+    background thread promotes waiting clubs in bulk whenever notify()
+    says spots may have freed up (or every 'interval' seconds), booking
+    them with the same checks as a normal booking. The waitlist lives in
+    the memory of one process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}  # competition name -> deque of [email, spots]
+        self._messages = {}  # club email -> messages for its next visit
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def join(self, competition_name, email, spots):
+        """Queue 'email' for 'spots' spots, return its 1-based position.
+
+        A club already waiting keeps its place with the new number of
+        spots.
+        """
+        with self._lock:
+            waiting = self._queues.setdefault(competition_name, deque())
+            for position, entry in enumerate(waiting, 1):
+                if entry[0] == email:
+                    entry[1] = spots
+                    return position
+            waiting.append([email, spots])
+            return len(waiting)
+
+    def position(self, competition_name, email):
+        """1-based position of 'email', None if it is not waiting"""
+        with self._lock:
+            for position, entry in enumerate(
+                    self._queues.get(competition_name, ()), 1):
+                if entry[0] == email:
+                    return position
+        return None
+
+    def notify(self):
+        """Spots may have freed up: wake the promotion thread"""
+        self._wakeup.set()
+
+    def messages(self, email):
+        """Pop the promotion messages for 'email'"""
+        with self._lock:
+            return self._messages.pop(email, [])
+
+    def promote(self, registry, check):
+        """Book waiting clubs while their competitions have spots.
+
+        check(club, competition, spots) returns None if the booking is
+        allowed, or else a (reason, message, status) tuple. A club that
+        can no longer book (unknown, out of points, competition over)
+        leaves the queue; the first club whose spots do not fit, or whose
+        booking conflicts with another, blocks the ones behind it until
+        the next round, to keep the order fair. Return the number of
+        clubs promoted.
+        """
+        promoted = 0
+        with self._lock:
+            names = [name for name, waiting in self._queues.items() if waiting]
+        for name in names:
+            competition = registry.competition_by_name(name)
+            while True:
+                with self._lock:
+                    waiting = self._queues.get(name)
+                    if not waiting:
+                        break
+                    email, spots = waiting[0]
+                if competition is None or competition.spots_available <= 0:
+                    break
+                if spots > competition.spots_available:
+                    break
+                club = registry.club_by_email(email)
+                error = None if club is None else check(
+                    club, competition, spots)
+                if error is not None and error[0] == "not_enough_spots":
+                    break
+                booked = False
+                if club is not None and error is None:
+                    booked = registry.book(club, competition, spots)
+                    if not booked:
+                        # Beaten to the spots: keep its place
+                        break
+                with self._lock:
+                    if waiting and waiting[0][0] == email:
+                        waiting.popleft()
+                    if booked:
+                        promoted += 1
+                        self._messages.setdefault(email, []).append(
+                            f"Great-you got {spots} spots in {name} "
+                            "from the waitlist!")
+            with self._lock:
+                if not self._queues.get(name):
+                    self._queues.pop(name, None)
+        return promoted
+
+    def start(self, get_registry, check, interval=5.0):
+        """Promote clubs in a background thread, on notify() or every
+        'interval' seconds, in the registry returned by get_registry()"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+                try:
+                    self.promote(get_registry(), check)
+                except Exception:
+                    logger.exception("Waitlist promotion failed")
+
+        self._thread = threading.Thread(
+            target=run, daemon=True, name="waitlist")
+        self._thread.start()